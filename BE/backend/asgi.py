@@ -5,6 +5,11 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+Production entry point (see Procfile): gunicorn with uvicorn workers, so the
+async equipment SSE stream can hold idle connections without pinning a
+worker thread each. Sync DRF views keep working through Django's thread
+executor.
 """
 
 import os
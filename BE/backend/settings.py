@@ -89,8 +89,13 @@ CORS_ALLOWED_ORIGINS = [ # 수정 FE(이 단락 전체)
     "http://localhost:5173",  # Vite 개발 환경의 프론트엔드 도메인
     "http://43.201.88.27",    # AWS 서버 IP
 ]
+# 재시도 중복 방지용 Idempotency-Key 요청 헤더 허용 / 재생 응답 표시 헤더 노출
+from corsheaders.defaults import default_headers  # noqa: E402
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
+CORS_EXPOSE_HEADERS = ['Idempotent-Replayed']
 
 WSGI_APPLICATION = 'backend.wsgi.application'
+ASGI_APPLICATION = 'backend.asgi.application'
 
 
 # ==========================================================
@@ -149,6 +154,18 @@ REST_FRAMEWORK = {
 
 WORKOUT_HEARTBEAT_TIMEOUT_SECONDS = 45
 WORKOUT_HEARTBEAT_START_GRACE_SECONDS = 15
+# heartbeat 저장 방식: 'redis'(공유 해시 + 일괄 flush), 'memory'(프로세스별 버퍼), 'db'(요청마다 UPDATE)
+WORKOUT_HEARTBEAT_STORE = env('WORKOUT_HEARTBEAT_STORE', default='redis')
+WORKOUT_HEARTBEAT_FLUSH_SECONDS = 5
+# 오래된 세션 정리는 heartbeat 요청이 아닌 `python manage.py run_session_sweeper` 서비스가
+# Redis 리스(leader lock)를 잡은 한 인스턴스에서만 수행합니다.
+WORKOUT_SWEEPER_INTERVAL_SECONDS = 5
+# 기구별 잠금(PostgreSQL advisory lock) 대기가 이 값(ms)을 넘으면 경고 로그
+WORKOUT_EQUIPMENT_LOCK_SLOW_MS = 200
+# 프로세스별 잠금 대기 통계(획득/경합 횟수, 평균/최대 대기)를 이 간격(초)마다 로그로 남깁니다.
+WORKOUT_EQUIPMENT_LOCK_STATS_LOG_SECONDS = 300
+# 종료된 세션/예약은 이 일수가 지나면 보관(archive) 테이블로 옮깁니다. 조회는 *_history 뷰 사용.
+WORKOUT_ARCHIVE_AFTER_DAYS = env.int('WORKOUT_ARCHIVE_AFTER_DAYS', default=30)
 
 # Simple JWT 설정: 액세스/리프레시 토큰 수명 연장
 from datetime import timedelta
@@ -182,17 +199,48 @@ SIMPLE_JWT = {
 CELERY_BROKER_URL = env('CELERY_BROKER_URL', default='redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = env('CELERY_RESULT_BACKEND', default=CELERY_BROKER_URL)
 
-# Beat 스케줄: expire task를 주기적으로 실행하여 NOTIFIED 예약 만료 처리를 수행합니다.
-# 권장: 알림 타임아웃(예: 15초)과 맞추기 위해 15초 간격으로 실행하는 것을 권장합니다.
+# 마감 시각 스케줄러: 알림(NOTIFIED) 만료와 세션 heartbeat 마감 시각을 Redis sorted set에
+# 등록하고, `python manage.py run_deadline_scheduler` 프로세스가 마감 후 ~1초 안에 처리합니다.
+WORKOUT_DEADLINE_SCHEDULER_ENABLED = env.bool('WORKOUT_DEADLINE_SCHEDULER_ENABLED', default=True)
+WORKOUT_DEADLINE_REDIS_URL = env('WORKOUT_DEADLINE_REDIS_URL', default=CELERY_BROKER_URL)
+WORKOUT_DEADLINE_TICK_SECONDS = 0.5
+
+# start/join/leave 요청의 Idempotency-Key 응답을 이 시간(초) 동안 Redis에 보관해 재시도 시 그대로 돌려줍니다.
+WORKOUT_IDEMPOTENCY_REDIS_URL = env('WORKOUT_IDEMPOTENCY_REDIS_URL', default=CELERY_BROKER_URL)
+WORKOUT_IDEMPOTENCY_TTL_SECONDS = 600
+# 처리 중(pending) 표시는 요청 타임아웃의 몇 배만 유지합니다. 워커가 요청 도중 죽어도
+# 같은 키의 재시도가 이 시간 뒤에는 다시 실행됩니다.
+WORKOUT_IDEMPOTENCY_PENDING_TTL_SECONDS = 90
+
+# Beat 스케줄: 만료 처리는 위 마감 시각 스케줄러가 담당하고, 아래 주기 작업은
+# 등록 누락/스케줄러 중단에 대비한 안전장치로 낮은 빈도로만 실행합니다.
 CELERY_BEAT_SCHEDULE = {
-    'expire-reservations-every-15s': {
+    'expire-reservations-sweep-every-60s': {
         'task': 'workouts.tasks.expire_notified_reservations',
-        'schedule': 15.0,  # seconds (recommended)
+        'schedule': 60.0,
         'args': (),
     },
-    'expire-stale-sessions-every-15s': {
+    'expire-stale-sessions-sweep-every-60s': {
         'task': 'workouts.tasks.expire_stale_sessions',
-        'schedule': 15.0,
+        'schedule': 60.0,
+        'args': (),
+    },
+    # 버퍼링된 heartbeat를 DB에 일괄 반영 (WORKOUT_HEARTBEAT_STORE='redis'일 때)
+    'flush-heartbeats-every-5s': {
+        'task': 'workouts.tasks.flush_heartbeats',
+        'schedule': 5.0,
+        'args': (),
+    },
+    # Equipment.waiting_count 비정규화 카운터 오차 보정 (안전장치)
+    'reconcile-waiting-counts-every-5m': {
+        'task': 'workouts.tasks.reconcile_waiting_counts',
+        'schedule': 300.0,
+        'args': (),
+    },
+    # 오래된 종료 세션/예약을 보관 테이블로 이동 (hot 테이블 크기 유지)
+    'archive-history-daily': {
+        'task': 'workouts.tasks.archive_history',
+        'schedule': 86400.0,
         'args': (),
     },
 }
@@ -203,6 +251,25 @@ CELERY_BEAT_SCHEDULE = {
 # INCREASED TO 30s TO REDUCE DB LOAD - Real-time updates handled by client polling instead
 EQUIPMENT_SSE_POLL_INTERVAL_SECONDS = 30
 
+# SSE 이벤트 버스 백엔드
+# - 'memory'  : 프로세스 내부 전용 (gunicorn 워커 1개 / 로컬 개발용)
+# - 'redis'   : Redis pub/sub. 여러 워커와 Celery에서 발행한 이벤트를 모든 SSE 연결이 수신합니다.
+# - 'postgres': PostgreSQL LISTEN/NOTIFY (기본 DB 사용)
+# 어떤 백엔드든 구독 연결은 프로세스당 하나만 사용합니다.
+EQUIPMENT_EVENT_BUS_BACKEND = env('EQUIPMENT_EVENT_BUS_BACKEND', default='memory')
+EQUIPMENT_EVENT_BUS_REDIS_URL = env('EQUIPMENT_EVENT_BUS_REDIS_URL', default=CELERY_BROKER_URL)
+EQUIPMENT_EVENT_BUS_CHANNEL = 'equipment_events'
+
+# True: /api/equipment/stream/ 을 async 뷰로 제공합니다 (backend.asgi + uvicorn 워커 필요).
+# WSGI(runserver, sync gunicorn 워커)에서는 async 스트림이 끝까지 버퍼링되어 전달되지 않으므로
+# 기본값은 False이며, ASGI 배포(Procfile)에서만 켭니다.
+EQUIPMENT_SSE_ASYNC = env.bool('EQUIPMENT_SSE_ASYNC', default=False)
+EQUIPMENT_SSE_HEARTBEAT_SECONDS = 30
+
+# 같은 기구에 대한 업데이트를 N ms 동안 모아 최신 상태 하나만 발행합니다 (0 = 즉시 발행).
+# 대기열이 몰리는 시간대의 이벤트 수와 COUNT 쿼리를 줄이며, 추가 지연은 최대 N ms 입니다.
+EQUIPMENT_EVENT_COALESCE_MS = env.int('EQUIPMENT_EVENT_COALESCE_MS', default=250)
+
 
 LOGGING = {
     "version": 1,
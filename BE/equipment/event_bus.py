@@ -1,49 +1,398 @@
+import asyncio
 import json
+import logging
 import threading
-from collections import deque
+import time
+import uuid
 from typing import Any, Dict, List, Optional
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.utils import timezone
 
+logger = logging.getLogger(__name__)
 
-class EquipmentEventBus:
-    """A tiny in-process pub/sub used by the SSE endpoint."""
 
-    def __init__(self, max_events: int = 500):
-        self._cond = threading.Condition()
-        self._events: deque[Dict[str, Any]] = deque(maxlen=max_events)
-        self._seq = 0
+class EventRing:
+    """
+    Fixed-size ring buffer indexed by sequence number.
+
+    Sequence numbers are contiguous, so the slot of seq N is N % capacity and
+    slicing "everything after seq N" costs O(missed events) without scanning
+    the buffer. `since()` returns None once the requested seq has been
+    overwritten, so callers can tell a gap apart from "nothing new".
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._slots: List[Optional[Dict[str, Any]]] = [None] * capacity
+        self.last_seq = 0
+
+    @property
+    def first_seq(self) -> int:
+        return max(1, self.last_seq - self.capacity + 1)
+
+    def append(self, event: Dict[str, Any]):
+        self.last_seq = event["seq"]
+        self._slots[self.last_seq % self.capacity] = event
+
+    def since(self, seq: int) -> Optional[List[Dict[str, Any]]]:
+        if seq >= self.last_seq:
+            return []
+        if seq + 1 < self.first_seq:
+            return None
+        return [self._slots[s % self.capacity] for s in range(seq + 1, self.last_seq + 1)]
+
+
+ALL_TOPICS = "*"
+
+
+def _wake_futures(futures):
+    for future in futures:
+        if not future.done():
+            future.set_result(None)
+
+
+class _Topic:
+    """Ring, condition and async waiters for one subscription topic (a gym)."""
 
-    def publish(self, payload: Dict[str, Any], event_type: str = "update"):
-        with self._cond:
-            self._seq += 1
+    def __init__(self, max_events: int):
+        self.cond = threading.Condition()
+        self.events = EventRing(max_events)
+        self.seq = 0
+        # asyncio subscribers grouped by event loop: one call_soon_threadsafe
+        # per loop wakes every async SSE stream of this topic served by that loop.
+        self.async_waiters: Dict[asyncio.AbstractEventLoop, set] = {}
+
+    def append(self, message: Dict[str, Any]):
+        with self.cond:
+            self.seq += 1
             event = {
-                "seq": self._seq,
-                "type": event_type,
-                "payload": payload,
-                "timestamp": timezone.now().isoformat(),
+                "seq": self.seq,
+                "type": message.get("type") or "update",
+                "payload": message.get("payload", {}),
+                "timestamp": message.get("timestamp") or timezone.now().isoformat(),
             }
-            self._events.append(event)
-            self._cond.notify_all()
+            self.events.append(event)
+            self.cond.notify_all()
+            async_waiters = [(loop, list(futures)) for loop, futures in self.async_waiters.items() if futures]
+
+        for loop, futures in async_waiters:
+            try:
+                loop.call_soon_threadsafe(_wake_futures, futures)
+            except RuntimeError:
+                # loop already closed; its streams are gone
+                continue
+
+    def collect(self, last_seq: int):
+        """Must be called with the condition held."""
+        events = self.events.since(last_seq)
+        if events is None:
+            # The consumer fell behind the ring; it has to reload a snapshot.
+            events = [{
+                "seq": self.seq,
+                "type": "resync",
+                "payload": {},
+                "timestamp": timezone.now().isoformat(),
+            }]
+        return events, self.seq, False
+
+
+class EquipmentEventBus:
+    """
+    A tiny in-process pub/sub used by the SSE endpoint.
+
+    Events are routed by topic (the equipment's gym id), so a publish only
+    wakes streams watching that gym. Streams without a gym subscribe to
+    ALL_TOPICS, which receives every event.
+    """
+
+    def __init__(self, max_events: int = 500):
+        self.max_events = max_events
+        self._topics: Dict[str, _Topic] = {}
+        self._topics_lock = threading.Lock()
+        # Sequence numbers are per process and restart with it. The instance id
+        # goes into every SSE `id:` so a Last-Event-ID from another worker or
+        # from before a restart is recognised as unresumable.
+        self.instance_id = uuid.uuid4().hex[:12]
+
+    def _topic(self, topic) -> _Topic:
+        key = ALL_TOPICS if topic is None else str(topic)
+        state = self._topics.get(key)
+        if state is None:
+            with self._topics_lock:
+                state = self._topics.setdefault(key, _Topic(self.max_events))
+        return state
+
+    def publish(self, payload: Dict[str, Any], event_type: str = "update", topic=None):
+        message = {
+            "type": event_type,
+            "topic": None if topic is None else str(topic),
+            "payload": payload,
+            "timestamp": timezone.now().isoformat(),
+        }
+        self._send(message)
 
-    def wait_for_events(self, last_seq: int, timeout: float = 30.0):
+    def _send(self, message: Dict[str, Any]):
+        """Transport hook: the in-memory bus delivers straight to local waiters."""
+        self._deliver(message)
+
+    def _deliver(self, message: Dict[str, Any]):
+        """Append a message to the local buffers and wake waiting SSE streams.
+
+        Sequence numbers are assigned here, per topic, so they are local to the
+        process that serves the SSE connection regardless of which process
+        published.
+        """
+        topic = message.get("topic")
+        if topic is not None and topic != ALL_TOPICS:
+            self._topic(topic).append(message)
+        self._topic(ALL_TOPICS).append(message)
+
+    def _ensure_listening(self):
+        """Subscription hook: remote backends start their listener here."""
+
+    def _is_listening(self) -> bool:
+        """True when _ensure_listening() would return without blocking."""
+        return True
+
+    def current_seq(self, topic=None) -> int:
+        # streams read the cursor before their snapshot: the listener must
+        # already be relaying by then or events published in between are lost
+        self._ensure_listening()
+        state = self._topic(topic)
+        with state.cond:
+            return state.seq
+
+    def format_event_id(self, seq: int, topic=None) -> str:
+        return f"{self.instance_id}-{ALL_TOPICS if topic is None else topic}-{seq}"
+
+    def parse_event_id(self, value: Optional[str], topic=None) -> Optional[int]:
+        """
+        Return the seq encoded in an SSE Last-Event-ID, or None when it was not
+        issued by this bus instance for this topic (other worker, restart,
+        different gym, malformed).
+        """
+        if not value:
+            return None
+        parts = value.split("-")
+        if len(parts) != 3:
+            return None
+        instance_id, event_topic, seq = parts
+        if instance_id != self.instance_id or event_topic != (ALL_TOPICS if topic is None else str(topic)):
+            return None
+        try:
+            seq = int(seq)
+        except ValueError:
+            return None
+        if seq < 0 or seq > self.current_seq(topic):
+            return None
+        return seq
+
+    def wait_for_events(self, last_seq: int, timeout: float = 30.0, topic=None):
         """
         Block until a new event with seq > last_seq is available or timeout elapses.
+        Returns (events, new_last_seq, timed_out). If events after last_seq were
+        already overwritten, a single synthetic "resync" event is returned.
+        """
+        self._ensure_listening()
+        state = self._topic(topic)
+        with state.cond:
+            if state.seq > last_seq:
+                return state.collect(last_seq)
+
+            state.cond.wait(timeout=timeout)
+            if state.seq > last_seq:
+                return state.collect(last_seq)
+            return [], last_seq, True
+
+    async def wait_for_events_async(self, last_seq: int, timeout: float = 30.0, topic=None):
+        """
+        asyncio counterpart of wait_for_events for ASGI streams. Waiting costs a
+        future on the running loop instead of a blocked thread.
         Returns (events, new_last_seq, timed_out)
         """
-        with self._cond:
-            if self._seq > last_seq:
-                events = [e for e in self._events if e["seq"] > last_seq]
-                return events, self._seq, False
-
-            self._cond.wait(timeout=timeout)
-            if self._seq > last_seq:
-                events = [e for e in self._events if e["seq"] > last_seq]
-                return events, self._seq, False
+        if not self._is_listening():
+            # starting the listener may wait for the broker; keep that off the loop
+            await sync_to_async(self._ensure_listening)()
+        state = self._topic(topic)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with state.cond:
+            if state.seq > last_seq:
+                return state.collect(last_seq)
+            state.async_waiters.setdefault(loop, set()).add(future)
+
+        try:
+            await asyncio.wait_for(future, timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with state.cond:
+                futures = state.async_waiters.get(loop)
+                if futures is not None:
+                    futures.discard(future)
+                    if not futures:
+                        del state.async_waiters[loop]
+
+        with state.cond:
+            if state.seq > last_seq:
+                return state.collect(last_seq)
             return [], last_seq, True
 
 
-equipment_event_bus = EquipmentEventBus()
+class _ListeningEventBus(EquipmentEventBus):
+    """
+    Base for cross-process backends. Publishing goes to a shared broker and a
+    single daemon thread per process relays broker messages into the local
+    buffer, so the number of broker subscriptions does not grow with the
+    number of open SSE connections.
+    """
+
+    reconnect_delay_seconds = 2.0
+    # how long the first subscriber waits for the broker subscription
+    subscribe_wait_seconds = 2.0
+
+    def __init__(self, channel: str, max_events: int = 500):
+        super().__init__(max_events=max_events)
+        self.channel = channel
+        self._listener: Optional[threading.Thread] = None
+        self._listener_lock = threading.Lock()
+        # set by _listen once the broker subscription is active
+        self._subscribed = threading.Event()
+
+    def _ensure_listening(self):
+        if self._listener is not None and self._listener.is_alive():
+            return
+        with self._listener_lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(
+                    target=self._listen_forever,
+                    name=f"{type(self).__name__}-listener",
+                    daemon=True,
+                )
+                self._listener.start()
+        if not self._subscribed.wait(self.subscribe_wait_seconds):
+            logger.warning("Event bus listener on %s not subscribed yet", self.channel)
+
+    def _is_listening(self) -> bool:
+        return self._listener is not None and self._listener.is_alive() and self._subscribed.is_set()
+
+    def _listen_forever(self):
+        while True:
+            try:
+                self._listen()
+            except Exception:
+                logger.exception("Event bus listener on %s failed; reconnecting", self.channel)
+            self._subscribed.clear()
+            time.sleep(self.reconnect_delay_seconds)
+
+    def _listen(self):
+        raise NotImplementedError
+
+    def _receive(self, raw):
+        try:
+            message = json.loads(raw)
+        except (TypeError, ValueError):
+            logger.warning("Dropping malformed event bus message on %s", self.channel)
+            return
+        self._deliver(message)
+
+
+class RedisEquipmentEventBus(_ListeningEventBus):
+    """Redis pub/sub backend. Requires the `redis` package (already used by Celery)."""
+
+    def __init__(self, url: str, channel: str, max_events: int = 500):
+        super().__init__(channel=channel, max_events=max_events)
+        self.url = url
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            import redis  # lazy import
+
+            self._client = redis.Redis.from_url(self.url)
+        return self._client
+
+    def _send(self, message: Dict[str, Any]):
+        try:
+            self._get_client().publish(self.channel, json.dumps(message))
+        except Exception:
+            logger.exception("Failed to publish equipment event to Redis channel %s", self.channel)
+
+    def _listen(self):
+        import redis  # lazy import
+
+        client = redis.Redis.from_url(self.url)
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(self.channel)
+            # consume the subscribe confirmation so the subscription is live
+            pubsub.get_message(timeout=self.subscribe_wait_seconds)
+            self._subscribed.set()
+            for message in pubsub.listen():
+                self._receive(message.get("data"))
+        finally:
+            pubsub.close()
+
+
+class PostgresEquipmentEventBus(_ListeningEventBus):
+    """PostgreSQL LISTEN/NOTIFY backend using the default database."""
+
+    poll_interval_seconds = 5.0
+
+    def __init__(self, channel: str, max_events: int = 500, using: str = "default"):
+        super().__init__(channel=channel, max_events=max_events)
+        self.using = using
+
+    def _send(self, message: Dict[str, Any]):
+        from django.db import connections
+
+        try:
+            with connections[self.using].cursor() as cursor:
+                cursor.execute("SELECT pg_notify(%s, %s)", [self.channel, json.dumps(message)])
+        except Exception:
+            logger.exception("Failed to publish equipment event via NOTIFY on %s", self.channel)
+
+    def _listen(self):
+        import select
+
+        import psycopg2  # lazy import
+        from django.db import connections
+
+        params = connections[self.using].get_connection_params()
+        conn = psycopg2.connect(**params)
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(f'LISTEN "{self.channel}"')
+            self._subscribed.set()
+            while True:
+                if select.select([conn], [], [], self.poll_interval_seconds) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    self._receive(conn.notifies.pop(0).payload)
+        finally:
+            conn.close()
+
+
+def _build_event_bus() -> EquipmentEventBus:
+    backend = getattr(settings, "EQUIPMENT_EVENT_BUS_BACKEND", "memory")
+    channel = getattr(settings, "EQUIPMENT_EVENT_BUS_CHANNEL", "equipment_events")
+    max_events = getattr(settings, "EQUIPMENT_EVENT_BUS_MAX_EVENTS", 500)
+
+    if backend == "redis":
+        url = getattr(settings, "EQUIPMENT_EVENT_BUS_REDIS_URL", None) or settings.CELERY_BROKER_URL
+        return RedisEquipmentEventBus(url=url, channel=channel, max_events=max_events)
+    if backend == "postgres":
+        return PostgresEquipmentEventBus(channel=channel, max_events=max_events)
+    if backend != "memory":
+        logger.warning("Unknown EQUIPMENT_EVENT_BUS_BACKEND %r; using in-memory bus", backend)
+    return EquipmentEventBus(max_events=max_events)
+
+
+equipment_event_bus = _build_event_bus()
 
 
 def _serialize_equipment(equipment) -> Dict[str, Any]:
@@ -61,25 +410,101 @@ def _serialize_equipment(equipment) -> Dict[str, Any]:
     }
 
 
-def publish_equipment_update(equipment, waiting_count: Optional[int] = None, extra: Optional[Dict[str, Any]] = None):
-    """Convenience helper to emit an equipment update SSE message."""
-    payload = _serialize_equipment(equipment)
+class EquipmentUpdateCoalescer:
+    """
+    Debounce window for equipment updates.
 
-    if waiting_count is None:
-        from workouts.models import Reservation  # lazy import
+    Within one window only the equipment ids are collected; when it closes,
+    the current state of every touched machine is loaded with a single
+    query and published once. A burst of queue churn on one machine
+    therefore costs one event per client instead of one per transition.
+    The window is not extended by further updates, so the extra latency is
+    bounded by `window_ms`.
+    """
 
-        waiting_count = (
-            Reservation.objects.filter(equipment=equipment, status="WAITING").count()
-        )
+    def __init__(self, window_ms: int):
+        self.window_ms = window_ms
+        self._lock = threading.Lock()
+        self._pending: set = set()
+        self._timer: Optional[threading.Timer] = None
+
+    def add(self, equipment_id):
+        with self._lock:
+            self._pending.add(equipment_id)
+            if self._timer is None:
+                # non-daemon so short-lived processes (commands) still flush on exit
+                self._timer = threading.Timer(self.window_ms / 1000.0, self.flush)
+                self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            ids = self._pending
+            self._pending = set()
+            self._timer = None
+        if not ids:
+            return
+
+        from django.db import close_old_connections
+
+        from equipment.models import Equipment  # lazy import
+
+        try:
+            for equipment in Equipment.objects.filter(pk__in=ids):
+                _publish_now(equipment, equipment.waiting_count)
+        except Exception:
+            logger.exception("Failed to flush coalesced equipment updates for %s", sorted(ids))
+        finally:
+            # the timer thread owns its own DB connection
+            close_old_connections()
 
+
+_coalesce_window_ms = int(getattr(settings, "EQUIPMENT_EVENT_COALESCE_MS", 0) or 0)
+equipment_update_coalescer = (
+    EquipmentUpdateCoalescer(_coalesce_window_ms) if _coalesce_window_ms > 0 else None
+)
+
+
+def _publish_now(equipment, waiting_count: int, extra: Optional[Dict[str, Any]] = None):
+    payload = _serialize_equipment(equipment)
     payload["waiting_count"] = waiting_count
+    # expected wait for someone joining now; read from the equipment row
+    from workouts.eta import estimate_wait_seconds  # lazy import
+
+    payload["estimated_wait_seconds"] = estimate_wait_seconds(equipment, waiting_count + 1)
     if extra:
         payload.update(extra)
 
-    equipment_event_bus.publish(payload)
+    equipment_event_bus.publish(payload, topic=equipment.gym_id)
+
+
+def publish_equipment_update(equipment, waiting_count: Optional[int] = None, extra: Optional[Dict[str, Any]] = None):
+    """
+    Convenience helper to emit an equipment update SSE message.
+
+    With EQUIPMENT_EVENT_COALESCE_MS set, plain updates are merged per
+    equipment within that window; calls that pass an explicit waiting_count
+    or extra fields are published immediately.
+    """
+    if equipment_update_coalescer is not None and waiting_count is None and not extra:
+        equipment_update_coalescer.add(equipment.pk)
+        return
+
+    if waiting_count is None:
+        # the in-memory instance may predate F() updates of the counter
+        from equipment.models import Equipment  # lazy import
+
+        waiting_count = (
+            Equipment.objects.filter(pk=equipment.pk).values_list("waiting_count", flat=True).first() or 0
+        )
+
+    _publish_now(equipment, waiting_count, extra)
 
 
 def publish_equipment_update_by_id(equipment_id: int):
+    if equipment_update_coalescer is not None:
+        equipment_update_coalescer.add(equipment_id)
+        return
+
     from equipment.models import Equipment  # lazy import
 
     try:
@@ -0,0 +1,28 @@
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def backfill_waiting_count(apps, schema_editor):
+    Equipment = apps.get_model('equipment', 'Equipment')
+    counts = Equipment.objects.annotate(
+        actual=Count('reservation', filter=Q(reservation__status='WAITING'))
+    ).filter(actual__gt=0).values_list('pk', 'actual')
+    for pk, actual in counts:
+        Equipment.objects.filter(pk=pk).update(waiting_count=actual)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('equipment', '0002_add_operational_state'),
+        ('workouts', '0003_add_last_heartbeat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='equipment',
+            name='waiting_count',
+            field=models.PositiveIntegerField(default=0, help_text='현재 WAITING 상태 예약 수 (자동 관리)'),
+        ),
+        migrations.RunPython(backfill_waiting_count, migrations.RunPython.noop),
+    ]
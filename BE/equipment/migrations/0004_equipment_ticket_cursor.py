@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('equipment', '0003_equipment_waiting_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='equipment',
+            name='last_ticket',
+            field=models.PositiveIntegerField(default=0, help_text='마지막으로 발급한 대기표 번호 (자동 관리)'),
+        ),
+        migrations.AddField(
+            model_name='equipment',
+            name='served_ticket',
+            field=models.PositiveIntegerField(default=0, help_text='마지막으로 호출된 대기표 번호 (자동 관리)'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations, models
+
+
+def backfill_busy_until(apps, schema_editor):
+    Equipment = apps.get_model('equipment', 'Equipment')
+    UsageSession = apps.get_model('workouts', 'UsageSession')
+    open_sessions = UsageSession.objects.filter(end_time__isnull=True).values_list('equipment_id', 'expected_end_at')
+    for equipment_id, expected_end_at in open_sessions:
+        Equipment.objects.filter(pk=equipment_id, status='IN_USE').update(busy_until=expected_end_at)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('equipment', '0004_equipment_ticket_cursor'),
+        ('workouts', '0005_usagesession_expected_end_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='equipment',
+            name='busy_until',
+            field=models.DateTimeField(blank=True, help_text='진행 중인 세션의 예상 종료 시각 (자동 관리)', null=True),
+        ),
+        migrations.AddField(
+            model_name='equipment',
+            name='avg_session_minutes',
+            field=models.FloatField(blank=True, help_text='실제 세션 길이 평균(분) (자동 관리)', null=True),
+        ),
+        migrations.AddField(
+            model_name='equipment',
+            name='avg_usage_ratio',
+            field=models.FloatField(default=1.0, help_text='실제/배정 시간 비율 평균, 조기 종료 반영 (자동 관리)'),
+        ),
+        migrations.AddField(
+            model_name='equipment',
+            name='no_show_rate',
+            field=models.FloatField(default=0.0, help_text='알림 후 시작하지 않고 만료된 비율 (자동 관리)'),
+        ),
+        migrations.RunPython(backfill_busy_until, migrations.RunPython.noop),
+    ]
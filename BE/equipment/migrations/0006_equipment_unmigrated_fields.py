@@ -0,0 +1,61 @@
+# image_url / body_part / ai_model_id는 models.py에만 추가되고 마이그레이션이 없었습니다.
+# 일부 DB에는 컬럼이 이미(수동으로) 만들어져 있으므로, 상태에는 항상 필드를 추가하고
+# 실제 컬럼은 없는 경우에만 만듭니다.
+from django.db import migrations, models
+
+
+class AddFieldIfMissing(migrations.AddField):
+    """
+    AddField that leaves an existing column alone. Each operation renders the
+    model from its own to_state, so on SQLite (which rebuilds the table for
+    every added column) the columns added by earlier operations are kept.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        connection = schema_editor.connection
+        with connection.cursor() as cursor:
+            columns = {
+                column.name
+                for column in connection.introspection.get_table_description(cursor, model._meta.db_table)
+            }
+        if model._meta.get_field(self.name).column in columns:
+            return
+        super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        # the column may predate this migration; never drop it
+        pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('equipment', '0005_equipment_wait_estimates'),
+    ]
+
+    operations = [
+        AddFieldIfMissing(
+            model_name='equipment',
+            name='image_url',
+            field=models.URLField(blank=True, help_text='운동기구 이미지 URL', max_length=500, null=True),
+        ),
+        AddFieldIfMissing(
+            model_name='equipment',
+            name='body_part',
+            field=models.CharField(
+                choices=[('UPPER', '상체'), ('LOWER', '하체'), ('CORE', '코어'), ('CARDIO', '유산소'), ('ETC', '기타')],
+                default='ETC',
+                help_text='이 기구의 주요 운동 부위 (AI 비율 계산에 사용)',
+                max_length=10,
+            ),
+        ),
+        AddFieldIfMissing(
+            model_name='equipment',
+            name='ai_model_id',
+            field=models.IntegerField(
+                default=0,
+                help_text='AI 모델이 인식하는 기구 ID (training_script.py와 일치해야 함, 예: 0=벤치)',
+            ),
+        ),
+    ]
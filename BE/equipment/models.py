@@ -35,6 +35,19 @@ class Equipment(models.Model):
         help_text='운영자가 설정하는 기구의 운영 상태 (정상 / 점검중)'
     )
     base_session_time_minutes = models.IntegerField(default=15)
+    # 대기열(WAITING) 인원 수 비정규화 카운터. 예약 상태 전이와 같은 트랜잭션에서
+    # workouts.session_management.adjust_waiting_count로 갱신되며,
+    # workouts.tasks.reconcile_waiting_counts가 주기적으로 오차를 보정합니다.
+    waiting_count = models.PositiveIntegerField(default=0, help_text="현재 WAITING 상태 예약 수 (자동 관리)")
+    # 대기표 번호: last_ticket은 마지막으로 발급한 번호, served_ticket은 마지막으로
+    # 알림(NOTIFIED) 처리된 번호입니다. 대기 중인 예약의 번호는 항상 served_ticket보다 큽니다.
+    last_ticket = models.PositiveIntegerField(default=0, help_text="마지막으로 발급한 대기표 번호 (자동 관리)")
+    served_ticket = models.PositiveIntegerField(default=0, help_text="마지막으로 호출된 대기표 번호 (자동 관리)")
+    # 예상 대기 시간(workouts.eta) 계산용 통계. 세션 종료/알림 만료 시 지수이동평균으로 갱신됩니다.
+    busy_until = models.DateTimeField(null=True, blank=True, help_text="진행 중인 세션의 예상 종료 시각 (자동 관리)")
+    avg_session_minutes = models.FloatField(null=True, blank=True, help_text="실제 세션 길이 평균(분) (자동 관리)")
+    avg_usage_ratio = models.FloatField(default=1.0, help_text="실제/배정 시간 비율 평균, 조기 종료 반영 (자동 관리)")
+    no_show_rate = models.FloatField(default=0.0, help_text="알림 후 시작하지 않고 만료된 비율 (자동 관리)")
     image_url = models.URLField(max_length=500, blank=True, null=True, help_text="운동기구 이미지 URL")
 
     BODY_PART_CHOICES = [
@@ -55,5 +68,12 @@ class Equipment(models.Model):
         help_text="AI 모델이 인식하는 기구 ID (training_script.py와 일치해야 함, 예: 0=벤치)"
     )
 
+    class Meta:
+        indexes = [
+            # 목록 조회 필터(gym + status / body_part / type) + id 커서 페이지네이션용
+            models.Index(fields=['gym', 'status', 'id'], name='equipment_gym_status_idx'),
+            models.Index(fields=['gym', 'body_part', 'type', 'id'], name='equipment_gym_part_type_idx'),
+        ]
+
     def __str__(self):
         return f'{self.gym.name} - {self.name}'
\ No newline at end of file
@@ -0,0 +1,23 @@
+# equipment/pagination.py
+
+from rest_framework.pagination import CursorPagination
+
+
+class EquipmentCursorPagination(CursorPagination):
+    """
+    기구 목록 키셋(cursor) 페이지네이션. id 순으로 정렬하므로 (gym_id, id)
+    인덱스 범위 조회로 페이지를 읽고, OFFSET 없이 다음 페이지로 이동합니다.
+
+    기존 클라이언트(FE는 응답을 배열로 받아 data.map 합니다)와의 호환을 위해
+    `cursor`나 `page_size` 파라미터가 없으면 페이지네이션하지 않고 배열을 그대로 반환합니다.
+    """
+    ordering = 'id'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
@@ -7,7 +7,21 @@ class EquipmentSerializer(serializers.ModelSerializer):
     # gym 필드를 ID 대신 헬스장 이름으로 보여주도록 설정합니다.
     gym = serializers.ReadOnlyField(source='gym.name')
 
+    def update(self, instance, validated_data):
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        # 서버가 관리하는 카운터 컬럼(waiting_count, 대기표 번호)을 덮어쓰지 않도록
+        # 변경된 필드만 저장합니다.
+        if validated_data:
+            instance.save(update_fields=list(validated_data))
+        return instance
+
     class Meta:
         model = Equipment
         # 모델의 모든 필드를 API에 포함시킵니다.
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+        # waiting_count는 예약 상태 전이에 따라 서버가 관리합니다.
+        read_only_fields = (
+            'waiting_count', 'last_ticket', 'served_ticket',
+            'busy_until', 'avg_session_minutes', 'avg_usage_ratio', 'no_show_rate',
+        )
\ No newline at end of file
@@ -1,3 +1,78 @@
+from django.contrib.auth.models import User
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from gyms.models import Gym
+from users.models import UserProfile
+
+from .models import Equipment
+
+
+class EquipmentMigrationTests(TestCase):
+    """The test database is built by running every migration from zero."""
+
+    def test_unmigrated_fields_exist_after_migrate(self):
+        with connection.cursor() as cursor:
+            columns = {
+                column.name
+                for column in connection.introspection.get_table_description(cursor, 'equipment_equipment')
+            }
+        self.assertTrue({'image_url', 'body_part', 'ai_model_id'} <= columns)
+
+    def test_list_indexes_exist_after_migrate(self):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, 'equipment_equipment')
+        self.assertEqual(constraints['equipment_gym_part_type_idx']['columns'], ['gym_id', 'body_part', 'type', 'id'])
+        self.assertEqual(constraints['equipment_gym_status_idx']['columns'], ['gym_id', 'status', 'id'])
+
+
+class EquipmentListTests(TestCase):
+    def setUp(self):
+        self.operator = User.objects.create_user('operator', password='pw')
+        UserProfile.objects.create(user=self.operator, role='OPERATOR')
+        self.gym = Gym.objects.create(owner=self.operator, name='gym', address='addr')
+        self.client = APIClient()
+        self.client.force_authenticate(self.operator)
+
+    def add_equipment(self, count):
+        start = Equipment.objects.count()
+        for i in range(start, start + count):
+            Equipment.objects.create(
+                gym=self.gym, name=f'eq{i}', type='STRENGTH', nfc_tag_id=f'nfc{i}', arduino_id=f'ard{i}'
+            )
+
+    def test_list_without_paging_params_is_a_plain_array(self):
+        self.add_equipment(3)
+        response = self.client.get('/api/equipment/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 3)
+
+    def test_cursor_pagination_with_page_size(self):
+        self.add_equipment(5)
+        response = self.client.get('/api/equipment/', {'page_size': 2})
+        self.assertEqual([item['name'] for item in response.data['results']], ['eq0', 'eq1'])
+
+        names = []
+        url = '/api/equipment/?page_size=2'
+        while url:
+            page = self.client.get(url).data
+            names.extend(item['name'] for item in page['results'])
+            url = page['next']
+        self.assertEqual(names, [f'eq{i}' for i in range(5)])
+
+    def assertConstantQueries(self, url):
+        self.add_equipment(1)
+        with CaptureQueriesContext(connection) as one:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.add_equipment(9)
+        with CaptureQueriesContext(connection) as ten:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(len(one), len(ten))
+
+    def test_list_query_count_does_not_grow_with_equipment(self):
+        self.assertConstantQueries('/api/equipment/')
+
+    def test_managed_query_count_does_not_grow_with_equipment(self):
+        self.assertConstantQueries('/api/equipment/managed/')
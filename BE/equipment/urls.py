@@ -1,14 +1,18 @@
 # equipment/urls.py
 
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import EquipmentViewSet, equipment_stream
+from .views import EquipmentViewSet, equipment_stream, equipment_stream_async
 
 router = DefaultRouter()
 # 'equipment' 경로에 EquipmentViewSet을 등록합니다.
 router.register(r'equipment', EquipmentViewSet, basename='equipment')
 
+# ASGI(uvicorn) 배포에서는 async SSE 뷰를, WSGI 배포에서는 기존 sync 뷰를 사용합니다.
+stream_view = equipment_stream_async if getattr(settings, 'EQUIPMENT_SSE_ASYNC', False) else equipment_stream
+
 urlpatterns = [
-    path('equipment/stream/', equipment_stream, name='equipment-stream'),
+    path('equipment/stream/', stream_view, name='equipment-stream'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
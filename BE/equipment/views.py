@@ -5,26 +5,29 @@ from rest_framework import viewsets, status
 # IsAuthenticated를 import 합니다.
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
 from .models import Equipment
+from .pagination import EquipmentCursorPagination
 from .serializers import EquipmentSerializer
 from users.models import UserProfile
-from reports.models import Report
 from gyms.models import GymMembership, Gym
 # NOTE: Avoid importing Reservation at module level to prevent circular import
 # and slow startup. Import inside functions where needed.
 # from workouts.models import Reservation
 
 # 추가: SSE(Server-Sent Events) 지원을 위한 임포트
+from asgiref.sync import sync_to_async
+from django.db.models import Count, Q
 from django.http import StreamingHttpResponse, HttpResponse
 import json
-import time
 from django.conf import settings
 from rest_framework_simplejwt.backends import TokenBackend
 from django.contrib.auth import get_user_model
 
 from .event_bus import equipment_event_bus
+from workouts.eta import estimate_join_wait_seconds
 
 
 class EquipmentViewSet(viewsets.ModelViewSet):
@@ -32,34 +35,31 @@ class EquipmentViewSet(viewsets.ModelViewSet):
     # use select_related for gym to avoid N+1 when serializer accesses gym.name
     queryset = Equipment.objects.all().select_related('gym')
     serializer_class = EquipmentSerializer
+    pagination_class = EquipmentCursorPagination
+    # 목록 조회 필터(쿼리 파라미터) -> 모델 필드
+    LIST_FILTERS = {'gym': 'gym_id', 'status': 'status', 'body_part': 'body_part', 'type': 'type'}
 
-    def list(self, request, *args, **kwargs):
-        """Override list to batch-compute waiting counts to avoid N+1 queries."""
-        from workouts.models import Reservation  # lazy import to avoid circular dependency at module load
-        from django.db.models import Count, Q
-        
-        # CRITICAL OPTIMIZATION: Use annotate to compute waiting_count in a SINGLE query
-        # instead of two separate queries (Equipment fetch + Reservation count)
-        qs = self.get_queryset().annotate(
-            waiting_count=Count(
-                'reservation',
-                filter=Q(reservation__status='WAITING'),
-                distinct=True
-            )
-        )
-        
-        serializer = self.get_serializer(qs, many=True)
-        data = serializer.data
-        
-        # Attach pre-computed waiting_count to serialized data
-        equips_list = list(qs)
-        for idx, item in enumerate(data):
-            if idx < len(equips_list):
-                item['waiting_count'] = equips_list[idx].waiting_count
-            else:
-                item['waiting_count'] = 0
-
-        return Response(data)
+    def get_queryset(self):
+        """
+        목록 조회는 ?gym=&status=&body_part=&type= 로 필터링합니다.
+        waiting_count는 Equipment 컬럼(비정규화 카운터)이므로 쿼리셋은 한 번만 평가됩니다.
+        """
+        queryset = super().get_queryset()
+        if self.action != 'list':
+            return queryset
+        params = self.request.query_params
+        filters = {}
+        for param, field in self.LIST_FILTERS.items():
+            value = params.get(param)
+            if value in (None, ''):
+                continue
+            if param == 'gym':
+                try:
+                    value = int(value)
+                except (TypeError, ValueError):
+                    raise ValidationError({'gym': 'gym은 정수 id여야 합니다.'})
+            filters[field] = value
+        return queryset.filter(**filters).order_by('id')
 
     @action(detail=True, methods=['patch'], url_path='operational-state')
     def set_operational_state(self, request, pk=None):
@@ -99,7 +99,7 @@ class EquipmentViewSet(viewsets.ModelViewSet):
             return Response({"detail": f"허용되지 않은 상태입니다. 허용값: {list(dict(Equipment.OPERATIONAL_STATE_CHOICES).keys())}"}, status=status.HTTP_400_BAD_REQUEST)
 
         equipment.operational_state = new_state
-        equipment.save()
+        equipment.save(update_fields=['operational_state'])
 
         serializer = self.get_serializer(equipment)
         return Response(serializer.data, status=status.HTTP_200_OK)
@@ -107,75 +107,234 @@ class EquipmentViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'], url_path='managed')
     def managed_equipments(self, request):
         """
-        운영자가 관리하는(소속된) 헬스장의 모든 기구와 각 기구의 운영 상태 및
-        불편 신고(대기) 건수를 반환합니다.
+        운영자가 관리하는(소속된) 헬스장의 모든 기구와 각 기구의 운영 상태,
+        불편 신고(대기) 건수, 대기 인원, 진행 중인 세션, 그리고 헬스장별 합계를 반환합니다.
 
         규칙(가정):
         - 운영자가 관리하는 헬스장 = user가 `Gym.owner`인 헬스장 OR
           `GymMembership` 테이블에서 status='APPROVED'로 등록된 헬스장
         - report_count는 현재 상태가 PENDING인 신고 건수로 집계합니다.
-        """
-        user = request.user
-        try:
-            profile = user.userprofile
-        except UserProfile.DoesNotExist:
-            return Response({"detail": "유효한 운영자 프로필이 필요합니다."}, status=status.HTTP_403_FORBIDDEN)
 
-        if profile.role != 'OPERATOR':
-            return Response({"detail": "운영자 권한이 필요합니다."}, status=status.HTTP_403_FORBIDDEN)
+        기구 목록은 gym을 함께 읽고 PENDING 신고 수를 집계하는 쿼리 하나,
+        진행 중인 세션은 쿼리 하나로 읽으므로 기구 수와 관계없이 쿼리 수가 일정합니다.
 
-        # gyms where user is owner
-        owner_gyms = Gym.objects.filter(owner=user).values_list('id', flat=True)
-        # gyms where user is an approved member (관리자 성격으로 가입한 경우)
-        member_gyms = GymMembership.objects.filter(user=user, status='APPROVED').values_list('gym_id', flat=True)
+        응답: {"gyms": [헬스장별 합계], "equipments": [기구별 상태]}
+        """
+        from workouts.models import UsageSession
 
-        gym_ids = set(list(owner_gyms) + list(member_gyms))
+        gym_ids, error = _operator_gym_ids(request.user)
+        if error is not None:
+            return error
 
-        equipments = Equipment.objects.filter(gym_id__in=gym_ids)
+        equipments = (
+            Equipment.objects.filter(gym_id__in=gym_ids)
+            .select_related('gym')
+            .annotate(report_count=Count('report', filter=Q(report__status='PENDING')))
+            .order_by('gym_id', 'id')
+        )
+        # 기구당 진행 중인 세션은 최대 하나입니다(session_one_open_per_equipment).
+        active_sessions = {
+            row['equipment_id']: row
+            for row in UsageSession.objects.filter(
+                end_time__isnull=True, equipment__gym_id__in=gym_ids
+            ).values('equipment_id', 'id', 'user_id', 'user__username', 'start_time', 'expected_end_at')
+        }
 
+        gyms = {
+            gym['id']: {
+                'gym_id': gym['id'],
+                'gym_name': gym['name'],
+                'equipment_count': 0,
+                'in_use_count': 0,
+                'maintenance_count': 0,
+                'waiting_count': 0,
+                'report_count': 0,
+            }
+            for gym in Gym.objects.filter(id__in=gym_ids).order_by('id').values('id', 'name')
+        }
         results = []
         for eq in equipments:
-            pending_reports = Report.objects.filter(equipment=eq, status='PENDING').count()
+            session = active_sessions.get(eq.id)
             results.append({
                 'id': eq.id,
                 'name': eq.name,
-                'gym_id': eq.gym.id,
+                'gym_id': eq.gym_id,
                 'gym_name': eq.gym.name,
+                'status': eq.status,
                 'operational_state': eq.operational_state,
-                'report_count': pending_reports,
+                'report_count': eq.report_count,
+                'waiting_count': eq.waiting_count,
+                'active_session': {
+                    'id': session['id'],
+                    'user_id': session['user_id'],
+                    'username': session['user__username'],
+                    'start_time': session['start_time'],
+                    'expected_end_at': session['expected_end_at'],
+                } if session else None,
             })
 
+            totals = gyms.get(eq.gym_id)
+            if totals is None:
+                continue
+            totals['equipment_count'] += 1
+            totals['in_use_count'] += eq.status == 'IN_USE'
+            totals['maintenance_count'] += eq.operational_state == 'MAINTENANCE'
+            totals['waiting_count'] += eq.waiting_count
+            totals['report_count'] += eq.report_count
+
+        return Response({'gyms': list(gyms.values()), 'equipments': results}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'], url_path='stuck')
+    def stuck_equipments(self, request):
+        """
+        운영자가 관리하는 헬스장에서 IN_USE 상태이지만 진행 중인 세션이 없는
+        기구 목록을 반환합니다. (stale-session sweeper와 같은 NOT EXISTS 조회 사용)
+        """
+        from workouts.session_management import stuck_in_use_equipment
+
+        gym_ids, error = _operator_gym_ids(request.user)
+        if error is not None:
+            return error
+
+        stuck = stuck_in_use_equipment(
+            Equipment.objects.filter(gym_id__in=gym_ids).select_related('gym')
+        ).order_by('gym_id', 'id')
+
+        results = [
+            {
+                'id': eq.id,
+                'name': eq.name,
+                'gym_id': eq.gym_id,
+                'gym_name': eq.gym.name,
+                'status': eq.status,
+                'waiting_count': eq.waiting_count,
+            }
+            for eq in stuck
+        ]
         return Response(results, status=status.HTTP_200_OK)
 
 
+def _operator_gym_ids(user):
+    """
+    Return (gym_ids, None) for an operator, or (None, 403 Response).
+    운영자가 관리하는 헬스장 = owner인 헬스장 + APPROVED 멤버십 헬스장
+    """
+    try:
+        profile = user.userprofile
+    except UserProfile.DoesNotExist:
+        return None, Response({"detail": "유효한 운영자 프로필이 필요합니다."}, status=status.HTTP_403_FORBIDDEN)
+
+    if profile.role != 'OPERATOR':
+        return None, Response({"detail": "운영자 권한이 필요합니다."}, status=status.HTTP_403_FORBIDDEN)
+
+    # gyms where user is owner
+    owner_gyms = Gym.objects.filter(owner=user).values_list('id', flat=True)
+    # gyms where user is an approved member (관리자 성격으로 가입한 경우)
+    member_gyms = GymMembership.objects.filter(user=user, status='APPROVED').values_list('gym_id', flat=True)
+
+    return set(list(owner_gyms) + list(member_gyms)), None
+
+
+def _authenticate_stream_token(token):
+    """
+    Decode a Simple JWT `access_token` query parameter and return the user id,
+    or None if the token is invalid. Shared by the sync and async SSE views.
+    """
+    try:
+        tb = TokenBackend(algorithm=settings.SIMPLE_JWT.get('ALGORITHM', 'HS256'), signing_key=settings.SIMPLE_JWT.get('SIGNING_KEY', settings.SECRET_KEY))
+        payload = tb.decode(token, verify=True)
+    except Exception:
+        return None
+    return payload.get('user_id') or payload.get('user')
+
+
+def _equipment_snapshot_queryset(gym_id=None):
+    # waiting_count is a denormalized column, so the snapshot is a single plain query
+    qs = Equipment.objects.all()
+    if gym_id is not None:
+        qs = qs.filter(gym_id=gym_id)
+    return qs
+
+
+def _serialize_snapshot_item(eq):
+    return {
+        'id': str(eq.id),
+        'name': eq.name,
+        'type': getattr(eq, 'type', None),
+        'status': getattr(eq, 'status', None),
+        'image_url': getattr(eq, 'image_url', '') or getattr(eq, 'image', ''),
+        'base_session_time_minutes': getattr(eq, 'base_session_time_minutes', None),
+        'waiting_count': eq.waiting_count,
+        'estimated_wait_seconds': estimate_join_wait_seconds(eq),
+    }
+
+
+def _sse_message(event_type, data, event_id=None):
+    id_line = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{id_line}event: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+
+def _resume_seq(request, gym_id):
+    """
+    Return the bus seq to resume from when the client reconnects with a
+    Last-Event-ID issued by this process for the same gym, else None (full
+    snapshot needed). EventSource sends the header automatically;
+    `last_event_id` in the query string covers clients that reopen the
+    stream manually.
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    return equipment_event_bus.parse_event_id(last_event_id, topic=gym_id)
+
+
+def _requested_gym_id(request):
+    """`gym_id` query parameter as int; raises ValueError when malformed."""
+    gym_id = request.GET.get('gym_id')
+    if gym_id in (None, ''):
+        return None
+    return int(gym_id)
+
+
+def _approved_gym_ids(user):
+    return GymMembership.objects.filter(user=user, status='APPROVED').values_list('gym_id', flat=True)
+
+
+def _sse_response(stream):
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # disable proxy buffering (nginx) so events are flushed immediately
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 def equipment_stream(request):
     """
     Simple SSE endpoint that accepts either session-authenticated requests
     or an `access_token` query parameter (Simple JWT). This view will
     stream an initial snapshot of equipments as an SSE 'initial' event,
-    then keep the connection alive by sending heartbeat events.
+    then push 'update' events from the equipment event bus and 'heartbeat'
+    events while idle.
+
+    The stream is scoped to one gym: `?gym_id=` if given, otherwise the
+    user's APPROVED GymMembership; users with neither see every gym.
+
+    Every snapshot/update carries an SSE `id:`. A client reconnecting with
+    Last-Event-ID gets only the events it missed; if those have already left
+    the bus buffer it gets a 'resync' event followed by a fresh 'initial'.
 
-    NOTE: This is a simple implementation intended to enable the FE to
-    open EventSource with a token-in-query. For production push updates
-    you should integrate with Django Channels, Redis pub/sub or another
-    async push mechanism to send updates when equipments change.
+    NOTE: This sync version blocks one worker thread per open stream. It is
+    kept for WSGI deployments; under ASGI use `equipment_stream_async`.
     """
     # Authenticate by token-in-query OR session/cookie
     token = request.GET.get('access_token')
     user = None
     if token:
+        user_id = _authenticate_stream_token(token)
+        if not user_id:
+            return HttpResponse(status=401)
+        User = get_user_model()
         try:
-            tb = TokenBackend(algorithm=settings.SIMPLE_JWT.get('ALGORITHM', 'HS256'), signing_key=settings.SIMPLE_JWT.get('SIGNING_KEY', settings.SECRET_KEY))
-            payload = tb.decode(token, verify=True)
-            user_id = payload.get('user_id') or payload.get('user')
-            if not user_id:
-                return HttpResponse(status=401)
-            User = get_user_model()
-            try:
-                user = User.objects.get(pk=user_id)
-            except User.DoesNotExist:
-                return HttpResponse(status=401)
-        except Exception as e:
+            user = User.objects.get(pk=user_id)
+        except User.DoesNotExist:
             return HttpResponse(status=401)
     else:
         # Fall back to Django authentication (session/cookie)
@@ -184,59 +343,121 @@ def equipment_stream(request):
         else:
             return HttpResponse(status=401)
 
-    def event_stream():
-        # initial snapshot: send all equipments as a single event
-        # CRITICAL OPTIMIZATION: Use annotate to compute waiting_count in a SINGLE query
-        from workouts.models import Reservation  # lazy import
-        from django.db.models import Count, Q
-        
-        equipments = Equipment.objects.all().annotate(
-            waiting_count=Count(
-                'reservation',
-                filter=Q(reservation__status='WAITING'),
-                distinct=True
-            )
-        )
-        
-        serialized = []
-        for eq in equipments:
-            serialized.append({
-                'id': str(eq.id),
-                'name': eq.name,
-                'type': getattr(eq, 'type', None),
-                'status': getattr(eq, 'status', None),
-                'image_url': getattr(eq, 'image_url', '') or getattr(eq, 'image', ''),
-                'base_session_time_minutes': getattr(eq, 'base_session_time_minutes', None),
-                'waiting_count': eq.waiting_count,
-            })
+    # gym to watch: explicit ?gym_id=, else the user's approved membership,
+    # else every gym (previous behaviour)
+    try:
+        gym_id = _requested_gym_id(request)
+    except ValueError:
+        return HttpResponse(status=400)
+    if gym_id is None:
+        gym_id = _approved_gym_ids(user).first()
+
+    resume_seq = _resume_seq(request, gym_id)
 
-        yield f"event: initial\ndata: {json.dumps(serialized)}\n\n"
-        # build last-seen snapshot to detect changes
-        last_state = {item['id']: item for item in serialized}
+    def snapshot():
+        # take the cursor before querying so nothing published meanwhile is missed
+        seq = equipment_event_bus.current_seq(gym_id)
+        serialized = [_serialize_snapshot_item(eq) for eq in _equipment_snapshot_queryset(gym_id)]
+        return seq, _sse_message('initial', serialized, equipment_event_bus.format_event_id(seq, gym_id))
+
+    def event_stream():
+        if resume_seq is not None:
+            # reconnect: only the missed deltas are replayed below
+            last_seq = resume_seq
+        else:
+            # initial snapshot: send all equipments as a single event
+            last_seq, message = snapshot()
+            yield message
 
         heartbeat = getattr(settings, 'EQUIPMENT_SSE_HEARTBEAT_SECONDS', 30)
-        last_seq = 0
 
         try:
             while True:
-                events, last_seq, timed_out = equipment_event_bus.wait_for_events(last_seq, timeout=heartbeat)
+                events, last_seq, timed_out = equipment_event_bus.wait_for_events(last_seq, timeout=heartbeat, topic=gym_id)
 
                 if events:
                     for event in events:
-                        payload = event.get('payload', {})
-                        eq_id = payload.get('id')
-                        if eq_id:
-                            last_state[eq_id] = payload
                         event_type = event.get('type') or 'update'
-                        yield f"event: {event_type}\ndata: {json.dumps(payload)}\n\n"
+                        if event_type == 'resync':
+                            # missed events were overwritten: tell the client, then resend the full state
+                            yield _sse_message('resync', {})
+                            last_seq, message = snapshot()
+                            yield message
+                            break
+                        yield _sse_message(event_type, event.get('payload', {}), equipment_event_bus.format_event_id(event['seq'], gym_id))
                 else:
                     # heartbeat keeps the connection alive while there are no events
-                    yield "event: heartbeat\ndata: {}\n\n"
+                    yield _sse_message('heartbeat', {})
 
         except GeneratorExit:
             # client disconnected
             return
 
-    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
-    response['Cache-Control'] = 'no-cache'
-    return response
\ No newline at end of file
+    return _sse_response(event_stream())
+
+
+async def equipment_stream_async(request):
+    """
+    ASGI version of `equipment_stream`. Idle streams await an asyncio future
+    on the event bus instead of blocking a worker thread, so one process can
+    hold many open EventSource connections. Emits the same
+    `initial` / `update` / `heartbeat` events as the sync view.
+    """
+    token = request.GET.get('access_token')
+    if token:
+        user_id = _authenticate_stream_token(token)
+        if not user_id:
+            return HttpResponse(status=401)
+        User = get_user_model()
+        try:
+            user = await User.objects.aget(pk=user_id)
+        except User.DoesNotExist:
+            return HttpResponse(status=401)
+    else:
+        user = await request.auser()
+        if not user or not user.is_authenticated:
+            return HttpResponse(status=401)
+
+    try:
+        gym_id = _requested_gym_id(request)
+    except ValueError:
+        return HttpResponse(status=400)
+    if gym_id is None:
+        gym_id = await _approved_gym_ids(user).afirst()
+
+    # both read the bus cursor, which may start its listener and wait for the
+    # broker subscription: run them off the event loop
+    resume_seq = await sync_to_async(_resume_seq)(request, gym_id)
+
+    async def snapshot():
+        seq = await sync_to_async(equipment_event_bus.current_seq)(gym_id)
+        serialized = [_serialize_snapshot_item(eq) async for eq in _equipment_snapshot_queryset(gym_id)]
+        return seq, _sse_message('initial', serialized, equipment_event_bus.format_event_id(seq, gym_id))
+
+    async def event_stream():
+        if resume_seq is not None:
+            last_seq = resume_seq
+        else:
+            last_seq, message = await snapshot()
+            yield message
+
+        heartbeat = getattr(settings, 'EQUIPMENT_SSE_HEARTBEAT_SECONDS', 30)
+
+        # Client disconnects surface as CancelledError raised at the await below;
+        # the bus unregisters the waiter in its own finally block.
+        while True:
+            events, last_seq, timed_out = await equipment_event_bus.wait_for_events_async(last_seq, timeout=heartbeat, topic=gym_id)
+
+            if events:
+                for event in events:
+                    event_type = event.get('type') or 'update'
+                    if event_type == 'resync':
+                        yield _sse_message('resync', {})
+                        last_seq, message = await snapshot()
+                        yield message
+                        break
+                    yield _sse_message(event_type, event.get('payload', {}), equipment_event_bus.format_event_id(event['seq'], gym_id))
+            else:
+                yield _sse_message('heartbeat', {})
+
+    return _sse_response(event_stream())
@@ -0,0 +1,120 @@
+"""
+Hot/cold split for queue and session history.
+
+Terminal rows older than WORKOUT_ARCHIVE_AFTER_DAYS (finished sessions,
+EXPIRED/COMPLETED reservations) are moved, in bounded batches, from the hot
+tables into ArchivedUsageSession / ArchivedReservation, tagged with their
+month. Each batch is one short transaction (copy, then delete by pk) using
+skip_locked, so it never waits on live queue traffic. Analytics read both
+halves through the UsageSessionHistory / ReservationHistory views.
+
+Run by the `archive_history` Celery task (daily) or management command.
+"""
+import logging
+import time
+from datetime import timedelta
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchivedReservation, ArchivedUsageSession, Reservation, UsageSession
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_RESERVATION_STATUSES = ('EXPIRED', 'COMPLETED')
+
+
+def _month(value):
+    return value.date().replace(day=1)
+
+
+def _archived_session(session: UsageSession) -> ArchivedUsageSession:
+    return ArchivedUsageSession(
+        id=session.pk,
+        user_id=session.user_id,
+        equipment_id=session.equipment_id,
+        start_time=session.start_time,
+        end_time=session.end_time,
+        last_heartbeat=session.last_heartbeat,
+        allocated_duration_minutes=session.allocated_duration_minutes,
+        expected_end_at=session.expected_end_at,
+        session_type=session.session_type,
+        month=_month(session.start_time),
+    )
+
+
+def _archived_reservation(reservation: Reservation) -> ArchivedReservation:
+    return ArchivedReservation(
+        id=reservation.pk,
+        user_id=reservation.user_id,
+        equipment_id=reservation.equipment_id,
+        created_at=reservation.created_at,
+        status=reservation.status,
+        notified_at=reservation.notified_at,
+        ticket=reservation.ticket,
+        claim_group=reservation.claim_group,
+        month=_month(reservation.created_at),
+    )
+
+
+# Both selections are range scans over partial indexes (session_ended_end_time_idx,
+# res_terminal_created_idx) in index order, so a batch never scans the hot table.
+def archivable_sessions(cutoff):
+    return UsageSession.objects.filter(end_time__isnull=False, end_time__lt=cutoff).order_by('end_time')
+
+
+def archivable_reservations(cutoff):
+    return Reservation.objects.filter(
+        status__in=TERMINAL_RESERVATION_STATUSES, created_at__lt=cutoff
+    ).order_by('created_at')
+
+
+def _move_batch(queryset, archive_model, to_archive, batch_size: int) -> int:
+    with transaction.atomic():
+        rows = list(queryset.select_for_update(skip_locked=True)[:batch_size])
+        if not rows:
+            return 0
+        # ignore_conflicts: a batch re-run after a crash between copy and delete
+        archive_model.objects.bulk_create([to_archive(row) for row in rows], ignore_conflicts=True)
+        queryset.model.objects.filter(pk__in=[row.pk for row in rows]).delete()
+    return len(rows)
+
+
+def archive_history(
+    older_than_days: Optional[int] = None,
+    batch_size: int = 500,
+    max_seconds: Optional[float] = None,
+    dry_run: bool = False,
+) -> Dict[str, int]:
+    """
+    Move terminal history older than `older_than_days` to the archive tables.
+    Stops early after `max_seconds`; the next run continues where it left off.
+    Returns {'sessions': n, 'reservations': n} (counts that would move when dry_run).
+    """
+    if older_than_days is None:
+        older_than_days = getattr(settings, 'WORKOUT_ARCHIVE_AFTER_DAYS', 30)
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+
+    jobs = (
+        ('sessions', archivable_sessions(cutoff), ArchivedUsageSession, _archived_session),
+        ('reservations', archivable_reservations(cutoff), ArchivedReservation, _archived_reservation),
+    )
+    if dry_run:
+        return {name: queryset.count() for name, queryset, _, _ in jobs}
+
+    started = time.monotonic()
+    moved = {name: 0 for name, _, _, _ in jobs}
+    for name, queryset, archive_model, to_archive in jobs:
+        while True:
+            if max_seconds is not None and time.monotonic() - started >= max_seconds:
+                logger.info("History archival stopped after %.0fs: %s", max_seconds, moved)
+                return moved
+            count = _move_batch(queryset, archive_model, to_archive, batch_size)
+            if not count:
+                break
+            moved[name] += count
+    if any(moved.values()):
+        logger.info("Archived history older than %s: %s", cutoff, moved)
+    return moved
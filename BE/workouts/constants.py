@@ -4,3 +4,6 @@
 # Single source-of-truth for notification timeout (minutes). 
 # Used by tasks.py, views.py, and serializers.py
 DEFAULT_NOTIFICATION_TIMEOUT_MINUTES = 0.25
+
+# Upper bound on how many equipment one group join ("any free squat rack") may queue on.
+MAX_GROUP_JOIN_EQUIPMENT = 10
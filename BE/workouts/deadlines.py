@@ -0,0 +1,174 @@
+"""
+Deadline scheduler for queue notifications and session heartbeats.
+
+Deadlines live in one Redis sorted set (member "<kind>:<id>", score = due
+epoch seconds). They are registered when a reservation becomes NOTIFIED and
+whenever a session's heartbeat deadline moves, and fired by the long-running
+`run_deadline_scheduler` management command within about a tick of expiry.
+The Celery beat sweeps keep running at a low frequency as a safety net, so a
+lost registration only delays an expiry instead of leaking it.
+
+Handlers always re-check the database, so firing early, late or twice is
+harmless.
+"""
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+RESERVATION_EXPIRY = 'reservation'
+SESSION_HEARTBEAT = 'session'
+
+# fire a little after the nominal deadline so the DB check sees it as overdue
+DEADLINE_SLACK_SECONDS = 0.5
+# back-off for a claimed deadline that could not be handled (row or machine
+# busy, clock drift); it is registered again instead of waiting for the beat sweep
+DEADLINE_RETRY_SECONDS = 1.0
+
+
+class DeadlineScheduler:
+    """Sorted-set timer store shared by web workers, Celery and the firing loop."""
+
+    def __init__(self, url: str, key: str = 'workouts:deadlines'):
+        self.url = url
+        self.key = key
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            import redis  # lazy import
+
+            self._client = redis.Redis.from_url(self.url, socket_timeout=1, socket_connect_timeout=1)
+        return self._client
+
+    def schedule_many(self, deadlines: Dict[str, float]):
+        if deadlines:
+            self._get_client().zadd(self.key, deadlines)
+
+    def cancel(self, kind: str, obj_id):
+        self._get_client().zrem(self.key, f'{kind}:{obj_id}')
+
+    def pop_due(self, now_ts: float, limit: int = 200) -> List[Tuple[str, int]]:
+        """
+        Claim due deadlines. ZREM is the claim, so with several firing loops
+        each deadline is handled once.
+        """
+        client = self._get_client()
+        claimed = []
+        for member in client.zrangebyscore(self.key, '-inf', now_ts, start=0, num=limit):
+            if not client.zrem(self.key, member):
+                continue
+            kind, _, obj_id = member.decode().partition(':')
+            try:
+                claimed.append((kind, int(obj_id)))
+            except ValueError:
+                logger.warning("Dropping malformed deadline %r", member)
+        return claimed
+
+
+def _build_scheduler() -> Optional[DeadlineScheduler]:
+    if not getattr(settings, 'WORKOUT_DEADLINE_SCHEDULER_ENABLED', False):
+        return None
+    url = getattr(settings, 'WORKOUT_DEADLINE_REDIS_URL', None) or settings.CELERY_BROKER_URL
+    return DeadlineScheduler(url)
+
+
+deadline_scheduler = _build_scheduler()
+
+
+def notification_timeout_seconds() -> float:
+    from .queue_engine import notification_timeout_minutes  # queue_engine imports this module
+
+    return notification_timeout_minutes() * 60
+
+
+def heartbeat_timeout_seconds() -> float:
+    return float(getattr(settings, 'WORKOUT_HEARTBEAT_TIMEOUT_SECONDS', 45))
+
+
+def _schedule_on_commit(deadlines: Dict[str, float]):
+    if deadline_scheduler is None or not deadlines:
+        return
+
+    def _register():
+        try:
+            deadline_scheduler.schedule_many(deadlines)
+        except Exception:
+            # the beat sweep still catches these, just later
+            logger.exception("Failed to register %d deadline(s)", len(deadlines))
+
+    transaction.on_commit(_register)
+
+
+def schedule_reservation_expiry(reservations: List[Tuple[int, object]]):
+    """Register expiry deadlines for [(reservation_id, notified_at), ...]."""
+    timeout = notification_timeout_seconds() + DEADLINE_SLACK_SECONDS
+    _schedule_on_commit({
+        f'{RESERVATION_EXPIRY}:{pk}': notified_at.timestamp() + timeout
+        for pk, notified_at in reservations
+        if notified_at is not None
+    })
+
+
+def schedule_session_heartbeat_deadline(session_id, last_heartbeat):
+    """(Re-)register the moment a session is considered abandoned."""
+    due = last_heartbeat.timestamp() + heartbeat_timeout_seconds() + DEADLINE_SLACK_SECONDS
+    _schedule_on_commit({f'{SESSION_HEARTBEAT}:{session_id}': due})
+
+
+def retry_deadlines(kind: str, obj_ids, delay: float = DEADLINE_RETRY_SECONDS):
+    """Register claimed-but-unhandled deadlines again, `delay` seconds from now."""
+    due = time.time() + delay
+    _schedule_on_commit({f'{kind}:{obj_id}': due for obj_id in obj_ids})
+
+
+def fire_due_deadlines(now_ts: Optional[float] = None) -> int:
+    """Handle every due deadline once. Returns the number of deadlines claimed."""
+    from .models import Reservation
+    from .queue_engine import expire_notified
+    from .session_management import finalize_overdue_heartbeat_sessions
+
+    if deadline_scheduler is None:
+        return 0
+    if now_ts is None:
+        now_ts = time.time()
+
+    due = deadline_scheduler.pop_due(now_ts)
+    reservation_ids = [obj_id for kind, obj_id in due if kind == RESERVATION_EXPIRY]
+    session_ids = [obj_id for kind, obj_id in due if kind == SESSION_HEARTBEAT]
+
+    if reservation_ids:
+        result = expire_notified(batch_size=len(reservation_ids), reservation_ids=reservation_ids)
+        if result['expired']:
+            logger.info("Deadline expiry: expired=%s notified=%s", result['expired'], result['notified'])
+        # still NOTIFIED: skipped (row or machine busy) or not yet overdue by the DB clock
+        leftover = list(Reservation.objects.filter(pk__in=reservation_ids, status='NOTIFIED').values_list('pk', flat=True))
+        if leftover:
+            retry_deadlines(RESERVATION_EXPIRY, leftover)
+
+    if session_ids:
+        ended = finalize_overdue_heartbeat_sessions(session_ids)
+        if ended:
+            logger.info("Deadline heartbeat timeout: ended %s session(s)", ended)
+
+    return len(due)
+
+
+def run_forever(tick_seconds: float = 0.5):
+    """Firing loop used by the run_deadline_scheduler command."""
+    from django.db import close_old_connections
+
+    while True:
+        try:
+            fired = fire_due_deadlines()
+        except Exception:
+            logger.exception("Deadline scheduler tick failed")
+            fired = 0
+        finally:
+            close_old_connections()
+        if not fired:
+            time.sleep(tick_seconds)
@@ -0,0 +1,94 @@
+"""
+Expected wait time per equipment queue.
+
+Estimates only read columns of the Equipment row, so they cost no queries:
+- busy_until: expected end of the running session, set when it starts
+- avg_session_minutes: actual session length
+- avg_usage_ratio: actual / allocated minutes (early finishes)
+- no_show_rate: notified users who let the notification expire
+
+The averages are exponentially weighted and updated incrementally with one
+UPDATE when a session ends or a notification resolves.
+"""
+from datetime import timedelta
+from typing import Dict, Optional
+
+from django.db.models import Case, F, FloatField, Value, When
+from django.utils import timezone
+
+from equipment.models import Equipment
+
+EWMA_ALPHA = 0.1
+
+
+def _ewma(field: str, sample: float):
+    return F(field) * (1 - EWMA_ALPHA) + Value(sample * EWMA_ALPHA)
+
+
+def expected_free_at(equipment: Equipment, start, allocated_minutes: float):
+    """When a session started now is expected to end, allowing for early finishes."""
+    ratio = min(max(equipment.avg_usage_ratio or 1.0, 0.0), 1.0)
+    return start + timedelta(minutes=allocated_minutes * ratio)
+
+
+def record_session_end(session, now=None):
+    """Fold one finished session into its equipment's length and usage averages."""
+    end = session.end_time or now or timezone.now()
+    actual = max((end - session.start_time).total_seconds() / 60, 0.0)
+    allocated = session.allocated_duration_minutes or 0
+    ratio = min(actual / allocated, 1.0) if allocated else 1.0
+    Equipment.objects.filter(pk=session.equipment_id).update(
+        avg_session_minutes=Case(
+            When(avg_session_minutes__isnull=True, then=Value(actual)),
+            default=_ewma('avg_session_minutes', actual),
+            output_field=FloatField(),
+        ),
+        avg_usage_ratio=_ewma('avg_usage_ratio', ratio),
+    )
+
+
+def record_no_shows(expired_per_equipment: Dict[int, int]):
+    """n expired notifications: rate <- 1 - (1 - rate) * (1 - alpha)^n, one UPDATE."""
+    expired_per_equipment = {eq_id: n for eq_id, n in expired_per_equipment.items() if n > 0}
+    if not expired_per_equipment:
+        return
+    Equipment.objects.filter(pk__in=expired_per_equipment).update(
+        no_show_rate=Value(1.0) - (Value(1.0) - F('no_show_rate')) * Case(
+            *[When(pk=eq_id, then=Value((1 - EWMA_ALPHA) ** n)) for eq_id, n in expired_per_equipment.items()],
+            default=Value(1.0),
+            output_field=FloatField(),
+        )
+    )
+
+
+def record_show(equipment_id):
+    """A notified user started the session."""
+    Equipment.objects.filter(pk=equipment_id).update(no_show_rate=F('no_show_rate') * (1 - EWMA_ALPHA))
+
+
+def estimate_wait_seconds(equipment: Equipment, position: Optional[int], now=None) -> Optional[int]:
+    """
+    Seconds until the reservation at `position` (1-based, WAITING) should be
+    notified: the rest of the running session plus, for everyone ahead, an
+    average session or, for a no-show, the notification timeout.
+    """
+    from .queue_engine import notification_timeout_minutes  # queue_engine imports this module
+
+    if position is None:
+        return None
+    if now is None:
+        now = timezone.now()
+
+    remaining = 0.0
+    if equipment.status == 'IN_USE' and equipment.busy_until is not None:
+        remaining = max((equipment.busy_until - now).total_seconds(), 0.0)
+
+    session_seconds = (equipment.avg_session_minutes or equipment.base_session_time_minutes or 0) * 60
+    no_show = min(max(equipment.no_show_rate or 0.0, 0.0), 1.0)
+    per_person = (1 - no_show) * session_seconds + no_show * notification_timeout_minutes() * 60
+    return int(round(remaining + max(position - 1, 0) * per_person))
+
+
+def estimate_join_wait_seconds(equipment: Equipment, now=None) -> int:
+    """Expected wait for someone joining the queue now (behind everyone waiting)."""
+    return estimate_wait_seconds(equipment, (equipment.waiting_count or 0) + 1, now=now)
@@ -0,0 +1,230 @@
+"""
+Heartbeat ingestion.
+
+Pings only record the latest timestamp per session in a fast store; a
+flusher persists everything that changed with one bulk UPDATE every
+WORKOUT_HEARTBEAT_FLUSH_SECONDS. Stale-session detection consults the fast
+store before trusting UsageSession.last_heartbeat, which may lag by up to
+one flush interval.
+
+Backends (WORKOUT_HEARTBEAT_STORE):
+- 'redis' : shared hash, flushed by the `flush_heartbeats` Celery task
+- 'memory': per-process buffer flushed by a timer thread in that process
+- 'db'    : no buffering, one UPDATE per ping
+"""
+import logging
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Dict, Iterable, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+FLUSH_CHUNK_SIZE = 500
+
+
+def _to_datetime(ts: float) -> datetime:
+    return datetime.fromtimestamp(ts, tz=dt_timezone.utc)
+
+
+class RedisHeartbeatStore:
+    """
+    `<key>` keeps the latest ping of every open session (read by detectors);
+    `<key>:dirty` holds pings not yet written to the database.
+    """
+
+    def __init__(self, url: str, key: str = 'workouts:heartbeats'):
+        self.url = url
+        self.key = key
+        self.dirty_key = f'{key}:dirty'
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            import redis  # lazy import
+
+            self._client = redis.Redis.from_url(self.url, socket_timeout=1, socket_connect_timeout=1)
+        return self._client
+
+    def record(self, session_id, ts: float):
+        pipe = self._get_client().pipeline(transaction=False)
+        pipe.hset(self.key, session_id, ts)
+        pipe.hset(self.dirty_key, session_id, ts)
+        pipe.execute()
+
+    def latest(self, session_ids) -> Dict[int, float]:
+        session_ids = list(session_ids)
+        if not session_ids:
+            return {}
+        values = self._get_client().hmget(self.key, session_ids)
+        return {pk: float(v) for pk, v in zip(session_ids, values) if v is not None}
+
+    def take_dirty(self) -> Dict[int, float]:
+        import redis  # lazy import
+
+        client = self._get_client()
+        # RENAME is atomic: pings arriving meanwhile go to a fresh dirty hash.
+        # The staging key is unique per flush so concurrent flushers (beat and
+        # the sweeper) never overwrite each other's staged hash.
+        flushing_key = f'{self.key}:flushing:{uuid.uuid4().hex}'
+        try:
+            client.rename(self.dirty_key, flushing_key)
+        except redis.exceptions.ResponseError:
+            # no such key: nothing buffered since the last flush
+            return {}
+        entries = client.hgetall(flushing_key)
+        client.delete(flushing_key)
+        return {int(k): float(v) for k, v in entries.items()}
+
+    def discard(self, session_ids: Iterable):
+        session_ids = list(session_ids)
+        if session_ids:
+            pipe = self._get_client().pipeline(transaction=False)
+            pipe.hdel(self.key, *session_ids)
+            pipe.hdel(self.dirty_key, *session_ids)
+            pipe.execute()
+
+
+class LocalHeartbeatStore:
+    """Per-process buffer; flushes itself from a daemon timer thread."""
+
+    def __init__(self, flush_seconds: float):
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._latest: Dict[int, float] = {}
+        self._dirty: Dict[int, float] = {}
+        self._timer: Optional[threading.Timer] = None
+
+    def record(self, session_id, ts: float):
+        with self._lock:
+            self._latest[session_id] = ts
+            self._dirty[session_id] = ts
+            if self._timer is None:
+                self._timer = threading.Timer(self.flush_seconds, self._flush_from_timer)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _flush_from_timer(self):
+        from django.db import close_old_connections
+
+        with self._lock:
+            self._timer = None
+        try:
+            flush_heartbeats(self)
+        except Exception:
+            logger.exception("Failed to flush buffered heartbeats")
+        finally:
+            close_old_connections()
+
+    def latest(self, session_ids) -> Dict[int, float]:
+        with self._lock:
+            return {pk: self._latest[pk] for pk in session_ids if pk in self._latest}
+
+    def take_dirty(self) -> Dict[int, float]:
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+            return dirty
+
+    def discard(self, session_ids: Iterable):
+        with self._lock:
+            for pk in session_ids:
+                self._latest.pop(pk, None)
+                self._dirty.pop(pk, None)
+
+
+def _build_store():
+    backend = getattr(settings, 'WORKOUT_HEARTBEAT_STORE', 'db')
+    if backend == 'redis':
+        url = getattr(settings, 'WORKOUT_HEARTBEAT_REDIS_URL', None) or settings.CELERY_BROKER_URL
+        return RedisHeartbeatStore(url)
+    if backend == 'memory':
+        return LocalHeartbeatStore(getattr(settings, 'WORKOUT_HEARTBEAT_FLUSH_SECONDS', 5))
+    if backend != 'db':
+        logger.warning("Unknown WORKOUT_HEARTBEAT_STORE %r; writing heartbeats directly", backend)
+    return None
+
+
+heartbeat_store = _build_store()
+
+
+def record_heartbeat(session_id, now=None):
+    """Record a ping. Falls back to a single unlocked UPDATE if the store fails."""
+    from .models import UsageSession
+
+    if now is None:
+        now = timezone.now()
+    if heartbeat_store is not None:
+        try:
+            heartbeat_store.record(session_id, now.timestamp())
+            return now
+        except Exception:
+            logger.exception("Heartbeat store unavailable; writing session %s directly", session_id)
+    UsageSession.objects.filter(pk=session_id, end_time__isnull=True).update(last_heartbeat=now)
+    return now
+
+
+def latest_heartbeats(session_ids) -> Dict[int, datetime]:
+    """Fast-store heartbeats for the given sessions ({} when unavailable)."""
+    if heartbeat_store is None:
+        return {}
+    try:
+        return {pk: _to_datetime(ts) for pk, ts in heartbeat_store.latest(session_ids).items()}
+    except Exception:
+        logger.exception("Failed to read heartbeat store")
+        return {}
+
+
+def fresh_heartbeats(session_ids, now=None, timeout_seconds: Optional[float] = None) -> Dict[int, datetime]:
+    """Sessions whose fast-store heartbeat is still within the timeout."""
+    if now is None:
+        now = timezone.now()
+    if timeout_seconds is None:
+        timeout_seconds = getattr(settings, 'WORKOUT_HEARTBEAT_TIMEOUT_SECONDS', 45)
+    cutoff = now - timedelta(seconds=timeout_seconds)
+    return {pk: ts for pk, ts in latest_heartbeats(session_ids).items() if ts >= cutoff}
+
+
+def forget_heartbeats(session_ids):
+    """Drop ended sessions from the fast store (after commit)."""
+    session_ids = list(session_ids)
+    if heartbeat_store is None or not session_ids:
+        return
+
+    def _discard():
+        try:
+            heartbeat_store.discard(session_ids)
+        except Exception:
+            logger.exception("Failed to discard heartbeats for %s", session_ids)
+
+    transaction.on_commit(_discard)
+
+
+def flush_heartbeats(store=None) -> int:
+    """Persist buffered heartbeats with one bulk UPDATE per chunk. Returns rows written."""
+    from .models import UsageSession
+
+    store = store or heartbeat_store
+    if store is None:
+        return 0
+    dirty = store.take_dirty()
+    if not dirty:
+        return 0
+
+    written = 0
+    items = list(dirty.items())
+    for start in range(0, len(items), FLUSH_CHUNK_SIZE):
+        chunk = items[start:start + FLUSH_CHUNK_SIZE]
+        written += UsageSession.objects.filter(
+            pk__in=[pk for pk, _ in chunk], end_time__isnull=True
+        ).update(
+            last_heartbeat=Case(
+                *[When(pk=pk, then=Value(_to_datetime(ts))) for pk, ts in chunk],
+                output_field=DateTimeField(),
+            )
+        )
+    return written
@@ -0,0 +1,149 @@
+"""
+Idempotency-Key support for the start / join / leave endpoints.
+
+A client retrying over a flaky connection sends the same `Idempotency-Key`
+header. The first request reserves the key in Redis (SET NX), runs, and
+stores its response for WORKOUT_IDEMPOTENCY_TTL_SECONDS; a replay returns
+the stored response without touching the queue tables or emitting SSE
+events. Keys are scoped per user and endpoint.
+
+- same key while the first request is still running -> 409
+- same key with a different request body          -> 422
+- 5xx responses are not stored, so the client may retry them
+- the pending marker only lives WORKOUT_IDEMPOTENCY_PENDING_TTL_SECONDS, so
+  a worker dying mid-request does not block retries for the full TTL
+If Redis is unavailable the request simply runs without idempotency.
+"""
+import functools
+import hashlib
+import json
+import logging
+from typing import Optional
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.response import Response
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 255
+_PENDING = '__pending__'
+
+
+class IdempotencyStore:
+    def __init__(self, url: str, ttl_seconds: int, pending_ttl_seconds: int = 90, prefix: str = 'workouts:idem'):
+        self.url = url
+        self.ttl_ms = int(ttl_seconds * 1000)
+        self.pending_ttl_ms = int(min(pending_ttl_seconds, ttl_seconds) * 1000)
+        self.prefix = prefix
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            import redis  # lazy import
+
+            self._client = redis.Redis.from_url(self.url, socket_timeout=1, socket_connect_timeout=1)
+        return self._client
+
+    def key(self, scope: str, user_id, idempotency_key: str) -> str:
+        return f'{self.prefix}:{scope}:{user_id}:{idempotency_key}'
+
+    def reserve(self, key: str) -> bool:
+        return bool(self._get_client().set(key, _PENDING, nx=True, px=self.pending_ttl_ms))
+
+    def get(self, key: str) -> Optional[str]:
+        value = self._get_client().get(key)
+        return value.decode() if value is not None else None
+
+    def store(self, key: str, value: str):
+        self._get_client().set(key, value, px=self.ttl_ms)
+
+    def release(self, key: str):
+        self._get_client().delete(key)
+
+
+def _build_store() -> Optional[IdempotencyStore]:
+    url = getattr(settings, 'WORKOUT_IDEMPOTENCY_REDIS_URL', None)
+    if not url:
+        return None
+    return IdempotencyStore(
+        url,
+        getattr(settings, 'WORKOUT_IDEMPOTENCY_TTL_SECONDS', 600),
+        getattr(settings, 'WORKOUT_IDEMPOTENCY_PENDING_TTL_SECONDS', 90),
+    )
+
+
+idempotency_store = _build_store()
+
+
+def _fingerprint(data) -> str:
+    body = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def idempotent(scope: str):
+    """Decorator for APIView.post honoring the Idempotency-Key header."""
+
+    def decorator(view_method):
+        @functools.wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            idempotency_key = request.META.get(IDEMPOTENCY_HEADER)
+            if not idempotency_key or idempotency_store is None:
+                return view_method(self, request, *args, **kwargs)
+            if len(idempotency_key) > MAX_KEY_LENGTH:
+                return Response({'error': 'Idempotency-Key가 너무 깁니다.'}, status=status.HTTP_400_BAD_REQUEST)
+
+            key = idempotency_store.key(scope, request.user.pk, idempotency_key)
+            fingerprint = _fingerprint(request.data)
+            try:
+                reserved = idempotency_store.reserve(key)
+                stored = None if reserved else idempotency_store.get(key)
+            except Exception:
+                logger.exception("Idempotency store unavailable; running %s without it", scope)
+                return view_method(self, request, *args, **kwargs)
+
+            if not reserved:
+                if stored is None:
+                    # expired between SET NX and GET: treat as a new request
+                    return view_method(self, request, *args, **kwargs)
+                if stored == _PENDING:
+                    return Response({'error': '같은 요청이 아직 처리 중입니다.'}, status=status.HTTP_409_CONFLICT)
+                entry = json.loads(stored)
+                if entry['fingerprint'] != fingerprint:
+                    return Response(
+                        {'error': '같은 Idempotency-Key로 다른 요청을 보낼 수 없습니다.'},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    )
+                response = Response(entry['data'], status=entry['status'])
+                response['Idempotent-Replayed'] = 'true'
+                return response
+
+            try:
+                response = view_method(self, request, *args, **kwargs)
+            except Exception:
+                _release(key)
+                raise
+
+            if response.status_code >= 500:
+                _release(key)
+                return response
+            try:
+                idempotency_store.store(key, json.dumps(
+                    {'fingerprint': fingerprint, 'status': response.status_code, 'data': response.data},
+                    default=str,
+                ))
+            except Exception:
+                logger.exception("Failed to store idempotent response for %s", scope)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def _release(key: str):
+    try:
+        idempotency_store.release(key)
+    except Exception:
+        logger.exception("Failed to release idempotency key %s", key)
@@ -0,0 +1,64 @@
+"""
+Cluster-wide leases (leader locks) backed by Redis.
+
+A lease is a key holding a random token with a TTL. The holder renews it
+before it expires; if the holder dies the key expires and another process
+can take over. Used so that only one stale-session sweeper runs at a time.
+"""
+import logging
+import uuid
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# renew if we still own the key, otherwise take it only if nobody does
+_ACQUIRE_OR_RENEW = """
+local current = redis.call('GET', KEYS[1])
+if current == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+if current then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+return 1
+"""
+
+_RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class Lease:
+    def __init__(self, name: str, ttl_seconds: float, url: str = None):
+        self.key = f'workouts:lease:{name}'
+        self.ttl_ms = int(ttl_seconds * 1000)
+        self.url = url or getattr(settings, 'WORKOUT_LEASE_REDIS_URL', None) or settings.CELERY_BROKER_URL
+        self.token = uuid.uuid4().hex
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            import redis  # lazy import
+
+            self._client = redis.Redis.from_url(self.url, socket_timeout=2, socket_connect_timeout=2)
+        return self._client
+
+    def acquire(self) -> bool:
+        """Take or renew the lease. Returns False (never raises) if not held."""
+        try:
+            return bool(self._get_client().eval(_ACQUIRE_OR_RENEW, 1, self.key, self.token, self.ttl_ms))
+        except Exception:
+            logger.exception("Lease %s: acquire failed", self.key)
+            return False
+
+    def release(self):
+        try:
+            self._get_client().eval(_RELEASE, 1, self.key, self.token)
+        except Exception:
+            logger.exception("Lease %s: release failed", self.key)
@@ -0,0 +1,152 @@
+"""
+Per-equipment serialization of queue and session state changes.
+
+Every transition touching one machine (start, end, join, leave, expiry,
+promotion, sweeps) runs under that equipment's key:
+- PostgreSQL: transaction-scoped advisory lock pg_advisory_xact_lock(ns, id)
+- other backends (SQLite dev/test): a process-local RLock per equipment id
+
+Acquisition order is fixed: equipment keys first, in ascending id order,
+and only then row locks (select_for_update). Code that already holds row
+locks (the skip_locked sweepers) must use blocking=False, which never waits
+and therefore cannot take part in a deadlock.
+
+Both kinds of lock are re-entrant within one transaction/thread, so helpers
+may take a key their caller already holds.
+"""
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+# advisory lock namespaces (classid) for equipment keys and claim groups
+EQUIPMENT_LOCK_NAMESPACE = 7301
+CLAIM_GROUP_LOCK_NAMESPACE = 7302
+
+
+class LockWaitStats:
+    """
+    Process-wide lock wait counters. A slow wait is logged on its own; the
+    totals are logged as a summary every WORKOUT_EQUIPMENT_LOCK_STATS_LOG_SECONDS.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.acquisitions = 0
+        self.contended = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        self._last_report = time.monotonic()
+
+    def record(self, wait_ms: float, keys):
+        slow_ms = getattr(settings, 'WORKOUT_EQUIPMENT_LOCK_SLOW_MS', 200)
+        report_every = getattr(settings, 'WORKOUT_EQUIPMENT_LOCK_STATS_LOG_SECONDS', 300)
+        now = time.monotonic()
+        with self._lock:
+            self.acquisitions += 1
+            self.total_wait_ms += wait_ms
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+            if wait_ms >= 1:
+                self.contended += 1
+            report = bool(report_every) and now - self._last_report >= report_every
+            if report:
+                self._last_report = now
+        if report:
+            logger.info("Equipment lock waits: %s", self.snapshot())
+        if wait_ms >= slow_ms:
+            logger.warning("Equipment lock wait %.1fms for %s", wait_ms, keys)
+        else:
+            logger.debug("Equipment lock wait %.2fms for %s", wait_ms, keys)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'acquisitions': self.acquisitions,
+                'contended': self.contended,
+                'total_wait_ms': round(self.total_wait_ms, 2),
+                'max_wait_ms': round(self.max_wait_ms, 2),
+                'avg_wait_ms': round(self.total_wait_ms / self.acquisitions, 3) if self.acquisitions else 0.0,
+            }
+
+
+lock_wait_stats = LockWaitStats()
+
+_local_locks = {}
+_local_locks_guard = threading.Lock()
+
+
+def _local_lock(equipment_id) -> threading.RLock:
+    with _local_locks_guard:
+        lock = _local_locks.get(equipment_id)
+        if lock is None:
+            lock = _local_locks[equipment_id] = threading.RLock()
+        return lock
+
+
+def _pg_acquire(keys, blocking: bool) -> bool:
+    sql = 'SELECT pg_advisory_xact_lock(%s, %s)' if blocking else 'SELECT pg_try_advisory_xact_lock(%s, %s)'
+    with connection.cursor() as cursor:
+        for eq_id in keys:
+            cursor.execute(sql, [EQUIPMENT_LOCK_NAMESPACE, eq_id])
+            if not blocking and not cursor.fetchone()[0]:
+                return False
+    return True
+
+
+def try_claim_group_lock(claim_group) -> bool:
+    """
+    Try to take a claim group (group join) for the rest of the transaction, so
+    two machines releasing at once cannot each promote a member of the same
+    group. Never waits, so it cannot deadlock against equipment keys.
+
+    Only PostgreSQL needs it: other backends serialize write transactions.
+    """
+    if connection.vendor != 'postgresql':
+        return True
+    key = uuid.UUID(str(claim_group)).int & 0x7FFFFFFF
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_xact_lock(%s, %s)', [CLAIM_GROUP_LOCK_NAMESPACE, key])
+        return bool(cursor.fetchone()[0])
+
+
+@contextmanager
+def equipment_lock(*equipment_ids, blocking: bool = True):
+    """
+    Hold the keys of the given equipment for the duration of the block, which
+    runs inside transaction.atomic(). Yields whether the keys were acquired
+    (always True when blocking).
+
+    Advisory locks are released when the outermost transaction ends; local
+    locks when this block exits.
+    """
+    keys = sorted({int(eq_id) for eq_id in equipment_ids if eq_id is not None})
+    started = time.perf_counter()
+
+    if connection.vendor == 'postgresql':
+        with transaction.atomic():
+            acquired = _pg_acquire(keys, blocking)
+            lock_wait_stats.record((time.perf_counter() - started) * 1000, keys)
+            yield acquired
+        return
+
+    held = []
+    try:
+        acquired = True
+        for eq_id in keys:
+            lock = _local_lock(eq_id)
+            if not lock.acquire(blocking=blocking):
+                acquired = False
+                break
+            held.append(lock)
+        lock_wait_stats.record((time.perf_counter() - started) * 1000, keys)
+        with transaction.atomic():
+            yield acquired
+    finally:
+        for lock in reversed(held):
+            lock.release()
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from workouts.archival import archive_history
+
+
+class Command(BaseCommand):
+    help = 'Move finished sessions and EXPIRED/COMPLETED reservations older than N days to the archive tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=getattr(settings, 'WORKOUT_ARCHIVE_AFTER_DAYS', 30),
+            help='이 일수보다 오래된 종료 행을 보관합니다. 기본값 WORKOUT_ARCHIVE_AFTER_DAYS.',
+        )
+        parser.add_argument('--batch-size', type=int, default=500, help='트랜잭션 하나에서 옮길 최대 행 수.')
+        parser.add_argument('--max-seconds', type=float, default=None, help='이 시간(초)이 지나면 중단합니다.')
+        parser.add_argument('--dry-run', action='store_true', help='옮길 행 수만 출력합니다.')
+
+    def handle(self, *args, **options):
+        moved = archive_history(
+            older_than_days=options['days'],
+            batch_size=options['batch_size'],
+            max_seconds=options['max_seconds'],
+            dry_run=options['dry_run'],
+        )
+        verb = 'Would archive' if options['dry_run'] else 'Archived'
+        self.stdout.write(
+            self.style.SUCCESS(f"{verb} {moved['sessions']} session(s), {moved['reservations']} reservation(s)")
+        )
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from workouts import deadlines
+
+
+class Command(BaseCommand):
+    help = 'Fire NOTIFIED-reservation and session-heartbeat deadlines as they fall due (long-running).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tick',
+            type=float,
+            default=getattr(settings, 'WORKOUT_DEADLINE_TICK_SECONDS', 0.5),
+            help='마감 시각이 없을 때 다시 확인하기까지 대기하는 시간(초). 기본값 0.5초.',
+        )
+
+    def handle(self, *args, **options):
+        if deadlines.deadline_scheduler is None:
+            raise CommandError('WORKOUT_DEADLINE_SCHEDULER_ENABLED is False; nothing to run.')
+
+        tick = options['tick']
+        self.stdout.write(f'Deadline scheduler running (tick={tick}s)')
+        deadlines.run_forever(tick_seconds=tick)
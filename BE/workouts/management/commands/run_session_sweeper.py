@@ -0,0 +1,50 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from workouts.leases import Lease
+from workouts.session_management import STALE_SESSION_SWEEPER_LEASE, cleanup_stale_sessions
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Run the stale-session sweeper (long-running). Only the lease holder sweeps, so several instances are safe.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=getattr(settings, 'WORKOUT_SWEEPER_INTERVAL_SECONDS', 5),
+            help='스윕 간격(초). 기본값 5초.',
+        )
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        lease = Lease(STALE_SESSION_SWEEPER_LEASE, ttl_seconds=max(interval * 3, 15))
+        self.stdout.write(f'Session sweeper running (interval={interval}s)')
+
+        leader = False
+        try:
+            while True:
+                started = time.monotonic()
+                is_leader = lease.acquire()
+                if is_leader != leader:
+                    leader = is_leader
+                    logger.info("Session sweeper %s the lease", "acquired" if leader else "lost")
+                if leader:
+                    try:
+                        cleaned = cleanup_stale_sessions(lease=lease)
+                        if cleaned:
+                            logger.info("Session sweeper cleaned %s session(s)/equipment", cleaned)
+                    except Exception:
+                        logger.exception("Session sweep failed")
+                    finally:
+                        close_old_connections()
+                time.sleep(max(0.0, interval - (time.monotonic() - started)))
+        finally:
+            if leader:
+                lease.release()
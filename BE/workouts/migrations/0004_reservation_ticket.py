@@ -0,0 +1,41 @@
+from django.db import migrations, models
+
+
+def backfill_tickets(apps, schema_editor):
+    Equipment = apps.get_model('equipment', 'Equipment')
+    Reservation = apps.get_model('workouts', 'Reservation')
+
+    equipment_ids = (
+        Reservation.objects.filter(status='WAITING')
+        .values_list('equipment_id', flat=True)
+        .distinct()
+    )
+    for equipment_id in list(equipment_ids):
+        waiting = Reservation.objects.filter(equipment_id=equipment_id, status='WAITING').order_by('created_at', 'pk')
+        ticket = 0
+        for reservation in waiting:
+            ticket += 1
+            reservation.ticket = ticket
+            reservation.save(update_fields=['ticket'])
+        Equipment.objects.filter(pk=equipment_id).update(last_ticket=ticket, served_ticket=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('equipment', '0004_equipment_ticket_cursor'),
+        ('workouts', '0003_add_last_heartbeat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reservation',
+            name='ticket',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['equipment', 'status', 'ticket'], name='res_equip_status_ticket_idx'),
+        ),
+        migrations.RunPython(backfill_tickets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+from django.db import migrations, models
+
+
+def backfill_expected_end_at(apps, schema_editor):
+    UsageSession = apps.get_model('workouts', 'UsageSession')
+    for session in UsageSession.objects.filter(end_time__isnull=True, expected_end_at__isnull=True):
+        session.expected_end_at = session.start_time + timedelta(minutes=session.allocated_duration_minutes)
+        session.save(update_fields=['expected_end_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workouts', '0004_reservation_ticket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usagesession',
+            name='expected_end_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_expected_end_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='usagesession',
+            index=models.Index(
+                condition=models.Q(('end_time__isnull', True)),
+                fields=['expected_end_at'],
+                name='session_open_expected_end_idx',
+            ),
+        ),
+    ]
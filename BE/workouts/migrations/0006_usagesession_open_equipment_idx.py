@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workouts', '0005_usagesession_expected_end_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='usagesession',
+            index=models.Index(
+                condition=models.Q(('end_time__isnull', True)),
+                fields=['equipment'],
+                name='session_open_equipment_idx',
+            ),
+        ),
+    ]
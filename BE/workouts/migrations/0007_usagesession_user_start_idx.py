@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workouts', '0006_usagesession_open_equipment_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='usagesession',
+            index=models.Index(fields=['user', 'start_time'], name='session_user_start_idx'),
+        ),
+    ]
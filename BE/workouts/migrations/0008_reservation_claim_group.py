@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workouts', '0007_usagesession_user_start_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reservation',
+            name='claim_group',
+            field=models.UUIDField(blank=True, db_index=True, null=True),
+        ),
+    ]
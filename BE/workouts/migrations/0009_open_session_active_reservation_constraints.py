@@ -0,0 +1,72 @@
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def resolve_duplicates(apps, schema_editor):
+    """Close/expire duplicates left by earlier races so the constraints can be created."""
+    UsageSession = apps.get_model('workouts', 'UsageSession')
+    Reservation = apps.get_model('workouts', 'Reservation')
+    now = timezone.now()
+
+    # keep the newest open session per user, then per equipment
+    for field in ('user_id', 'equipment_id'):
+        seen = set()
+        stale_ids = []
+        open_sessions = UsageSession.objects.filter(end_time__isnull=True).order_by('-start_time', '-pk')
+        for pk, owner in open_sessions.values_list('pk', field):
+            if owner in seen:
+                stale_ids.append(pk)
+            seen.add(owner)
+        if stale_ids:
+            UsageSession.objects.filter(pk__in=stale_ids).update(end_time=now)
+
+    # keep the earliest active reservation per (user, equipment)
+    seen = set()
+    duplicate_ids = []
+    active = Reservation.objects.filter(status__in=['WAITING', 'NOTIFIED']).order_by('created_at', 'pk')
+    for pk, user_id, equipment_id in active.values_list('pk', 'user_id', 'equipment_id'):
+        if (user_id, equipment_id) in seen:
+            duplicate_ids.append(pk)
+        seen.add((user_id, equipment_id))
+    if duplicate_ids:
+        Reservation.objects.filter(pk__in=duplicate_ids).update(status='EXPIRED')
+    # Equipment.waiting_count is corrected by the reconcile_waiting_counts task
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workouts', '0008_reservation_claim_group'),
+    ]
+
+    operations = [
+        migrations.RunPython(resolve_duplicates, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='usagesession',
+            name='session_open_equipment_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='usagesession',
+            constraint=models.UniqueConstraint(
+                condition=models.Q(('end_time__isnull', True)),
+                fields=('user',),
+                name='session_one_open_per_user',
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name='usagesession',
+            constraint=models.UniqueConstraint(
+                condition=models.Q(('end_time__isnull', True)),
+                fields=('equipment',),
+                name='session_one_open_per_equipment',
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name='reservation',
+            constraint=models.UniqueConstraint(
+                condition=models.Q(('status__in', ['WAITING', 'NOTIFIED'])),
+                fields=('user', 'equipment'),
+                name='reservation_one_active_per_user_equipment',
+            ),
+        ),
+    ]
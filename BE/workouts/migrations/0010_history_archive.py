@@ -0,0 +1,105 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+SESSION_HISTORY_VIEW = """
+CREATE VIEW workouts_usagesession_history AS
+SELECT id, user_id, equipment_id, start_time, end_time, allocated_duration_minutes, session_type,
+       FALSE AS is_archived
+FROM workouts_usagesession
+UNION ALL
+SELECT id, user_id, equipment_id, start_time, end_time, allocated_duration_minutes, session_type,
+       TRUE AS is_archived
+FROM workouts_archivedusagesession
+"""
+
+RESERVATION_HISTORY_VIEW = """
+CREATE VIEW workouts_reservation_history AS
+SELECT id, user_id, equipment_id, created_at, status, notified_at, FALSE AS is_archived
+FROM workouts_reservation
+UNION ALL
+SELECT id, user_id, equipment_id, created_at, status, notified_at, TRUE AS is_archived
+FROM workouts_archivedreservation
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('equipment', '0005_equipment_wait_estimates'),
+        ('workouts', '0009_open_session_active_reservation_constraints'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedUsageSession',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('start_time', models.DateTimeField()),
+                ('end_time', models.DateTimeField(blank=True, null=True)),
+                ('last_heartbeat', models.DateTimeField(blank=True, null=True)),
+                ('allocated_duration_minutes', models.IntegerField()),
+                ('expected_end_at', models.DateTimeField(blank=True, null=True)),
+                ('session_type', models.CharField(choices=[('BASE', 'Base'), ('AI_RECOMMENDED', 'AI Recommended'), ('EXTENDED', 'Extended')], max_length=20)),
+                ('month', models.DateField(db_index=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('equipment', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='equipment.equipment')),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'start_time'], name='arch_session_user_start_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedReservation',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField()),
+                ('status', models.CharField(choices=[('WAITING', 'Waiting'), ('NOTIFIED', 'Notified'), ('EXPIRED', 'Expired'), ('COMPLETED', 'Completed')], max_length=20)),
+                ('notified_at', models.DateTimeField(blank=True, null=True)),
+                ('ticket', models.PositiveIntegerField(blank=True, null=True)),
+                ('claim_group', models.UUIDField(blank=True, null=True)),
+                ('month', models.DateField(db_index=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('equipment', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='equipment.equipment')),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UsageSessionHistory',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('start_time', models.DateTimeField()),
+                ('end_time', models.DateTimeField(blank=True, null=True)),
+                ('allocated_duration_minutes', models.IntegerField()),
+                ('session_type', models.CharField(choices=[('BASE', 'Base'), ('AI_RECOMMENDED', 'AI Recommended'), ('EXTENDED', 'Extended')], max_length=20)),
+                ('is_archived', models.BooleanField()),
+                ('equipment', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='equipment.equipment')),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'workouts_usagesession_history',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ReservationHistory',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField()),
+                ('status', models.CharField(choices=[('WAITING', 'Waiting'), ('NOTIFIED', 'Notified'), ('EXPIRED', 'Expired'), ('COMPLETED', 'Completed')], max_length=20)),
+                ('notified_at', models.DateTimeField(blank=True, null=True)),
+                ('is_archived', models.BooleanField()),
+                ('equipment', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='equipment.equipment')),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'workouts_reservation_history',
+                'managed': False,
+            },
+        ),
+        migrations.RunSQL(SESSION_HISTORY_VIEW, 'DROP VIEW IF EXISTS workouts_usagesession_history'),
+        migrations.RunSQL(RESERVATION_HISTORY_VIEW, 'DROP VIEW IF EXISTS workouts_reservation_history'),
+    ]
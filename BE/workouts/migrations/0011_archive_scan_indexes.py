@@ -0,0 +1,27 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workouts', '0010_history_archive'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='usagesession',
+            index=models.Index(
+                condition=models.Q(end_time__isnull=False),
+                fields=['end_time'],
+                name='session_ended_end_time_idx',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(
+                condition=models.Q(status__in=['EXPIRED', 'COMPLETED']),
+                fields=['created_at'],
+                name='res_terminal_created_idx',
+            ),
+        ),
+    ]
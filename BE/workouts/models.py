@@ -1,7 +1,10 @@
 # workouts/models.py
 
+from datetime import timedelta
+
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 from equipment.models import Equipment
 
 class UsageSession(models.Model):
@@ -11,6 +14,8 @@ class UsageSession(models.Model):
     end_time = models.DateTimeField(null=True, blank=True)
     last_heartbeat = models.DateTimeField(null=True, blank=True, db_index=True)
     allocated_duration_minutes = models.IntegerField()
+    # start_time + allocated_duration_minutes, 저장 시 자동 계산 (만료 작업의 범위 조회용)
+    expected_end_at = models.DateTimeField(null=True, blank=True)
     
     SESSION_TYPE_CHOICES = [
         ('BASE', 'Base'),
@@ -19,6 +24,51 @@ class UsageSession(models.Model):
     ]
     session_type = models.CharField(max_length=20, choices=SESSION_TYPE_CHOICES)
 
+    class Meta:
+        indexes = [
+            # expire_active_sessions: range scan over open sessions only
+            models.Index(
+                fields=['expected_end_at'],
+                condition=models.Q(end_time__isnull=True),
+                name='session_open_expected_end_idx',
+            ),
+            # AI feature window: a user's sessions by start time
+            models.Index(fields=['user', 'start_time'], name='session_user_start_idx'),
+            # history archival: finished sessions by end time
+            models.Index(
+                fields=['end_time'],
+                condition=models.Q(end_time__isnull=False),
+                name='session_ended_end_time_idx',
+            ),
+        ]
+        constraints = [
+            # 사용자당 / 기구당 진행 중인 세션은 하나. 부분 유니크 인덱스라 진행 중 세션 조회와
+            # NOT EXISTS 고장 기구 탐지도 이 인덱스를 사용합니다.
+            models.UniqueConstraint(
+                fields=['user'],
+                condition=models.Q(end_time__isnull=True),
+                name='session_one_open_per_user',
+            ),
+            models.UniqueConstraint(
+                fields=['equipment'],
+                condition=models.Q(end_time__isnull=True),
+                name='session_one_open_per_equipment',
+            ),
+        ]
+
+    def compute_expected_end_at(self):
+        start = self.start_time or timezone.now()
+        return start + timedelta(minutes=self.allocated_duration_minutes or 0)
+
+    def save(self, *args, **kwargs):
+        # Keep expected_end_at in step on create and whenever the allocation is
+        # extended. QuerySet.update() bypasses this and must set it explicitly.
+        self.expected_end_at = self.compute_expected_end_at()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'expected_end_at' not in update_fields:
+            kwargs['update_fields'] = list(update_fields) + ['expected_end_at']
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f'{self.user.username} used {self.equipment.name} at {self.start_time}'
 
@@ -35,13 +85,104 @@ class Reservation(models.Model):
     ]
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='WAITING', db_index=True)
     notified_at = models.DateTimeField(null=True, blank=True)
+    # 기구별 단조 증가 대기표 번호 (Equipment.last_ticket에서 발급)
+    ticket = models.PositiveIntegerField(null=True, blank=True)
+    # 여러 기구에 한 번에 대기할 때 같은 값을 공유합니다. 그중 하나가 알림(NOTIFIED)되면
+    # 나머지 WAITING 예약은 같은 트랜잭션에서 철회(EXPIRED)됩니다.
+    claim_group = models.UUIDField(null=True, blank=True, db_index=True)
 
     class Meta:
         # Composite index for fast equipment waiting count queries
         indexes = [
             models.Index(fields=['equipment', 'status'], name='res_equip_status_idx'),
             models.Index(fields=['status', 'notified_at'], name='res_status_notified_idx'),
+            # queue position = indexed range count over tickets ahead
+            models.Index(fields=['equipment', 'status', 'ticket'], name='res_equip_status_ticket_idx'),
+            # history archival: terminal reservations by creation time
+            models.Index(
+                fields=['created_at'],
+                condition=models.Q(status__in=['EXPIRED', 'COMPLETED']),
+                name='res_terminal_created_idx',
+            ),
+        ]
+        constraints = [
+            # 사용자는 기구마다 WAITING/NOTIFIED 예약을 하나만 가질 수 있습니다.
+            models.UniqueConstraint(
+                fields=['user', 'equipment'],
+                condition=models.Q(status__in=['WAITING', 'NOTIFIED']),
+                name='reservation_one_active_per_user_equipment',
+            ),
         ]
 
     def __str__(self):
-        return f'{self.user.username} reserved {self.equipment.name}'
\ No newline at end of file
+        return f'{self.user.username} reserved {self.equipment.name}'
+
+
+# ==========================================================
+# 이력 보관(hot/cold 분리): workouts.archival이 오래된 종료 행을 아래 테이블로 옮깁니다.
+# id는 원본과 동일하게 유지하며, 분석용 조회는 *History(뷰) 모델을 사용합니다.
+# ==========================================================
+
+class ArchivedUsageSession(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    equipment = models.ForeignKey(Equipment, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    start_time = models.DateTimeField()
+    end_time = models.DateTimeField(null=True, blank=True)
+    last_heartbeat = models.DateTimeField(null=True, blank=True)
+    allocated_duration_minutes = models.IntegerField()
+    expected_end_at = models.DateTimeField(null=True, blank=True)
+    session_type = models.CharField(max_length=20, choices=UsageSession.SESSION_TYPE_CHOICES)
+    # start_time 기준 월 (YYYY-MM-01), 월 단위 조회/정리용
+    month = models.DateField(db_index=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'start_time'], name='arch_session_user_start_idx'),
+        ]
+
+
+class ArchivedReservation(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    equipment = models.ForeignKey(Equipment, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    created_at = models.DateTimeField()
+    status = models.CharField(max_length=20, choices=Reservation.STATUS_CHOICES)
+    notified_at = models.DateTimeField(null=True, blank=True)
+    ticket = models.PositiveIntegerField(null=True, blank=True)
+    claim_group = models.UUIDField(null=True, blank=True)
+    # created_at 기준 월 (YYYY-MM-01)
+    month = models.DateField(db_index=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+
+class UsageSessionHistory(models.Model):
+    """Read-only UNION ALL of live and archived sessions (database view)."""
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    equipment = models.ForeignKey(Equipment, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    start_time = models.DateTimeField()
+    end_time = models.DateTimeField(null=True, blank=True)
+    allocated_duration_minutes = models.IntegerField()
+    session_type = models.CharField(max_length=20, choices=UsageSession.SESSION_TYPE_CHOICES)
+    is_archived = models.BooleanField()
+
+    class Meta:
+        managed = False
+        db_table = 'workouts_usagesession_history'
+
+
+class ReservationHistory(models.Model):
+    """Read-only UNION ALL of live and archived reservations (database view)."""
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    equipment = models.ForeignKey(Equipment, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    created_at = models.DateTimeField()
+    status = models.CharField(max_length=20, choices=Reservation.STATUS_CHOICES)
+    notified_at = models.DateTimeField(null=True, blank=True)
+    is_archived = models.BooleanField()
+
+    class Meta:
+        managed = False
+        db_table = 'workouts_reservation_history'
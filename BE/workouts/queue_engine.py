@@ -0,0 +1,446 @@
+"""
+Queue engine: the single owner of reservation state transitions.
+
+- join:      enqueue_reservation / enqueue_group (ticketed WAITING rows)
+- promotion: promote_reservation, bulk_promote_heads (WAITING -> NOTIFIED)
+- expiry:    expire_notified (NOTIFIED past the timeout -> EXPIRED, then
+             promote the next heads), driven in bounded batches
+- release:   release_equipment (machine back to AVAILABLE + promotion)
+
+Views, the Celery tasks, the deadline scheduler and the expire_reservations
+command all go through these functions, so batching, skip_locked, the
+notification timeout and the SSE side effects live in one place.
+"""
+import logging
+import time
+import uuid
+from collections import Counter
+from datetime import timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When, Window
+from django.db.models.functions import Greatest, RowNumber
+from django.utils import timezone
+
+from equipment.event_bus import publish_equipment_update, publish_equipment_update_by_id
+from equipment.models import Equipment
+
+from .constants import DEFAULT_NOTIFICATION_TIMEOUT_MINUTES
+from .deadlines import schedule_reservation_expiry
+from .eta import record_no_shows
+from .locks import equipment_lock, try_claim_group_lock
+from .models import Reservation
+
+logger = logging.getLogger(__name__)
+
+
+def notification_timeout_minutes() -> float:
+    """WORKOUT_NOTIFICATION_TIMEOUT_MINUTES if set, else the shared default."""
+    minutes = getattr(settings, 'WORKOUT_NOTIFICATION_TIMEOUT_MINUTES', None)
+    if minutes is None:
+        minutes = DEFAULT_NOTIFICATION_TIMEOUT_MINUTES
+    try:
+        return float(minutes)
+    except (TypeError, ValueError):
+        return float(DEFAULT_NOTIFICATION_TIMEOUT_MINUTES or 0.25)
+
+
+def notification_cutoff(timeout_minutes: Optional[float] = None, now=None):
+    """Notifications issued before this moment have expired."""
+    if timeout_minutes is None:
+        timeout_minutes = notification_timeout_minutes()
+    return (now or timezone.now()) - timedelta(minutes=timeout_minutes)
+
+
+def notify_equipment_change(equipment: Optional[Equipment]):
+    if equipment is None:
+        return
+
+    def _emit():
+        publish_equipment_update(equipment)
+
+    transaction.on_commit(_emit)
+
+
+def enqueue_reservation(user, equipment: Equipment, claim_group=None):
+    """
+    Create a WAITING reservation holding the equipment's next ticket number.
+    Must run inside a transaction; the counter UPDATE locks the equipment row
+    until commit, so tickets are unique and increase in join order.
+    Returns (reservation, waiting_count including the new reservation).
+    """
+    Equipment.objects.filter(pk=equipment.pk).update(
+        last_ticket=F('last_ticket') + 1,
+        waiting_count=F('waiting_count') + 1,
+    )
+    ticket, waiting_count = (
+        Equipment.objects.filter(pk=equipment.pk).values_list('last_ticket', 'waiting_count').get()
+    )
+    reservation = Reservation.objects.create(
+        user=user, equipment=equipment, status='WAITING', ticket=ticket, claim_group=claim_group
+    )
+    return reservation, waiting_count
+
+
+def enqueue_group(user, equipments: List[Equipment]):
+    """
+    Join several equivalent machines with one logical ticket.
+
+    If one of them is AVAILABLE with nobody waiting or notified, the user is
+    notified on it right away and nothing else is queued. Otherwise one WAITING
+    reservation per machine is created under a shared claim_group; the first
+    one promoted withdraws the rest (see withdraw_sibling_claims).
+
+    The caller holds equipment_lock() for all of `equipments`.
+    Returns (assigned reservation or None, [(reservation, waiting_count), ...]).
+    """
+    ids = [eq.pk for eq in equipments]
+    held = set(
+        Reservation.objects.filter(equipment_id__in=ids, status='NOTIFIED').values_list('equipment_id', flat=True)
+    )
+    for equipment in equipments:
+        if equipment.status == 'AVAILABLE' and not equipment.waiting_count and equipment.pk not in held:
+            reservation, _ = enqueue_reservation(user, equipment)
+            promote_reservation(reservation)
+            return reservation, []
+
+    claim_group = uuid.uuid4()
+    return None, [enqueue_reservation(user, equipment, claim_group=claim_group) for equipment in equipments]
+
+
+def withdraw_sibling_claims(reservation_ids) -> Counter:
+    """
+    Expire the still-WAITING siblings (same claim_group) of the given
+    reservations and decrement their machines' waiting counters.
+
+    Sibling rows sit on other machines whose keys the caller does not hold
+    (taking them now would break the key-then-row lock order), so the rows
+    are taken with skip_locked and the other machines' counters are only
+    decremented after commit, one autocommit UPDATE per machine. A skipped
+    sibling just stays queued and its notification expires normally; a
+    counter lost to a crash is fixed by reconcile_waiting_counts.
+    Returns {equipment_id: withdrawn count}.
+    """
+    groups = Reservation.objects.filter(pk__in=reservation_ids, claim_group__isnull=False).values('claim_group')
+    siblings = list(
+        Reservation.objects.select_for_update(skip_locked=True)
+        .filter(claim_group__in=groups, status='WAITING')
+        .exclude(pk__in=reservation_ids)
+        .values_list('pk', 'equipment_id')
+    )
+    if not siblings:
+        return Counter()
+
+    Reservation.objects.filter(pk__in=[pk for pk, _ in siblings]).update(status='EXPIRED')
+    withdrawn = Counter(eq_id for _, eq_id in siblings)
+    transaction.on_commit(lambda: _release_withdrawn_slots(dict(withdrawn)))
+    return withdrawn
+
+
+def _release_withdrawn_slots(withdrawn: Dict[int, int]):
+    for eq_id, n in sorted(withdrawn.items()):
+        Equipment.objects.filter(pk=eq_id).update(waiting_count=Greatest(F('waiting_count') - n, 0))
+        publish_equipment_update_by_id(eq_id)
+
+
+def next_waiting_queryset(equipment_id):
+    """WAITING reservations of one equipment in queue (ticket) order."""
+    return Reservation.objects.filter(equipment_id=equipment_id, status='WAITING').order_by('ticket', 'created_at')
+
+
+def promote_reservation(reservation: Reservation, now=None):
+    """
+    Move a WAITING reservation to NOTIFIED, decrement the equipment's waiting
+    counter and advance its served-ticket cursor in one UPDATE.
+
+    For a reservation the caller just created; queue heads (which may belong
+    to a claim group) are promoted with bulk_promote_heads.
+    """
+    if now is None:
+        now = timezone.now()
+
+    reservation.status = 'NOTIFIED'
+    reservation.notified_at = now
+    reservation.save(update_fields=['status', 'notified_at'])
+
+    updates = {'waiting_count': Greatest(F('waiting_count') - 1, 0)}
+    if reservation.ticket is not None:
+        updates['served_ticket'] = Greatest(F('served_ticket'), reservation.ticket)
+    Equipment.objects.filter(pk=reservation.equipment_id).update(**updates)
+    if reservation.claim_group is not None:
+        withdraw_sibling_claims([reservation.pk])
+    schedule_reservation_expiry([(reservation.pk, now)])
+    return reservation
+
+
+def bulk_promote_heads(promotions: Dict[int, int], now=None) -> Dict[int, int]:
+    """
+    Promote the first `n` WAITING reservations of each equipment in
+    `promotions` ({equipment_id: n}) to NOTIFIED with a fixed number of
+    statements: one ROW_NUMBER() window query picks the heads, one UPDATE
+    promotes them and one UPDATE adjusts the equipment counters.
+
+    A user queued on several machines (claim_group) is promoted on at most
+    one of them: heads are row-locked (skip_locked) and their group try-locked
+    before promotion, and a head whose group was already served elsewhere is
+    withdrawn. Skipped heads are passed over and the next person on those
+    machines is promoted in another round.
+
+    The caller holds equipment_lock() for these ids; the equipment rows are
+    then locked in pk order (for reconcile_waiting_counts).
+    Returns {equipment_id: promoted count}.
+    """
+    if now is None:
+        now = timezone.now()
+    total = Counter()
+    skipped_ids = set()
+    while True:
+        promotions = {eq_id: n for eq_id, n in promotions.items() if n > 0}
+        if not promotions:
+            return dict(total)
+        promoted, promotions = _promote_heads_once(promotions, now, skipped_ids)
+        total.update(promoted)
+
+
+def _promote_heads_once(promotions: Dict[int, int], now, skipped_ids: Set[int]) -> Tuple[Counter, Counter]:
+    """One bulk_promote_heads round. Returns (promoted, refill) per equipment."""
+    list(Equipment.objects.select_for_update().filter(pk__in=promotions).order_by('pk').values_list('pk', flat=True))
+
+    # Django only supports conjunctive filters on window functions, so the
+    # per-equipment quota is an annotation compared against the rank.
+    heads = list(
+        Reservation.objects.filter(equipment_id__in=promotions, status='WAITING')
+        .exclude(pk__in=skipped_ids)
+        .annotate(
+            quota=Case(
+                *[When(equipment_id=eq_id, then=Value(n)) for eq_id, n in promotions.items()],
+                default=Value(0),
+                output_field=IntegerField(),
+            ),
+            queue_rank=Window(
+                RowNumber(),
+                partition_by=[F('equipment_id')],
+                order_by=[F('ticket').asc(), F('created_at').asc()],
+            ),
+        )
+        .filter(queue_rank__lte=F('quota'))
+        .values_list('pk', 'equipment_id', 'ticket', 'claim_group')
+        .order_by('ticket', 'pk')
+    )
+
+    # Lock the heads before changing them. A row another transaction holds
+    # (a sibling being withdrawn, a leave in progress) is skipped, never
+    # promoted from a stale read.
+    locked = set(
+        Reservation.objects.select_for_update(skip_locked=True)
+        .filter(pk__in=[pk for pk, _, _, _ in heads], status='WAITING')
+        .values_list('pk', flat=True)
+    )
+    # groups already served elsewhere (a sibling left WAITING because its row
+    # was locked when the group was withdrawn)
+    groups = {claim_group for _, _, _, claim_group in heads if claim_group is not None}
+    resolved = set(
+        Reservation.objects.filter(claim_group__in=groups, notified_at__isnull=False)
+        .values_list('claim_group', flat=True)
+    ) if groups else set()
+
+    # one notification per claim group; the others are withdrawn below and
+    # their machines get another round
+    refill = Counter()
+    seen_groups = set()
+    kept = []
+    stale = []
+    for pk, eq_id, ticket, claim_group in heads:
+        if pk not in locked:
+            refill[eq_id] += 1
+            skipped_ids.add(pk)
+            continue
+        if claim_group is not None:
+            if claim_group in resolved:
+                stale.append((pk, eq_id))
+                refill[eq_id] += 1
+                skipped_ids.add(pk)
+                continue
+            if claim_group in seen_groups or not try_claim_group_lock(claim_group):
+                refill[eq_id] += 1
+                skipped_ids.add(pk)
+                continue
+            seen_groups.add(claim_group)
+        kept.append((pk, eq_id, ticket))
+    heads = kept
+
+    # leftovers of groups served elsewhere leave this queue (we hold its key)
+    withdrawn_here = Counter(eq_id for _, eq_id in stale)
+    if stale:
+        Reservation.objects.filter(pk__in=[pk for pk, _ in stale]).update(status='EXPIRED')
+    if not heads and not stale:
+        return Counter(), refill
+
+    # counters follow the rows this UPDATE actually changed
+    kept_ids = [pk for pk, _, _ in heads]
+    Reservation.objects.filter(pk__in=kept_ids, status='WAITING').update(status='NOTIFIED', notified_at=now)
+    heads = list(
+        Reservation.objects.filter(pk__in=kept_ids, status='NOTIFIED', notified_at=now)
+        .values_list('pk', 'equipment_id', 'ticket')
+    )
+
+    promoted = Counter(eq_id for _, eq_id, _ in heads)
+    served = {}
+    for _, eq_id, ticket in heads:
+        if ticket is not None:
+            served[eq_id] = max(ticket, served.get(eq_id, 0))
+
+    left = promoted + withdrawn_here
+    Equipment.objects.filter(pk__in=left).update(
+        waiting_count=Greatest(
+            F('waiting_count') - Case(
+                *[When(pk=eq_id, then=Value(n)) for eq_id, n in left.items()],
+                default=Value(0),
+                output_field=IntegerField(),
+            ),
+            0,
+        ),
+        served_ticket=Greatest(
+            F('served_ticket'),
+            Case(
+                *[When(pk=eq_id, then=Value(t)) for eq_id, t in served.items()],
+                default=Value(0),
+                output_field=IntegerField(),
+            ),
+        ),
+    )
+    if seen_groups:
+        withdraw_sibling_claims([pk for pk, _, _ in heads])
+    schedule_reservation_expiry([(pk, now) for pk, _, _ in heads])
+    return promoted, refill
+
+
+def bulk_expire_notified(
+    cutoff, batch_size: int = 50, now=None, reservation_ids=None, skipped_ids: Optional[Set[int]] = None
+) -> Tuple[int, int, int, Set[int]]:
+    """
+    Expire one batch of NOTIFIED reservations notified before `cutoff` and
+    promote, per equipment, as many WAITING heads as reservations expired
+    there (so two expiries on one machine still notify two people).
+    `reservation_ids` restricts the batch (used by the deadline scheduler).
+
+    Must run inside a transaction. Candidates are locked with skip_locked, so
+    concurrent runners take disjoint batches; since their rows are then
+    already locked, equipment keys are only tried (blocking=False). Rows whose
+    machine is busy are added to `skipped_ids` and left for the next run.
+    Returns (candidates found, expired, notified, touched equipment ids).
+    """
+    if skipped_ids is None:
+        skipped_ids = set()
+    qs = Reservation.objects.filter(status='NOTIFIED', notified_at__lt=cutoff).exclude(pk__in=skipped_ids)
+    if reservation_ids is not None:
+        qs = qs.filter(pk__in=reservation_ids)
+    batch = list(
+        qs.select_for_update(skip_locked=True)
+        .order_by('notified_at')
+        .values_list('pk', 'equipment_id')[:batch_size]
+    )
+    if not batch:
+        return 0, 0, 0, set()
+
+    with equipment_lock(*{eq_id for _, eq_id in batch}, blocking=False) as acquired:
+        if acquired:
+            expired, notified = _expire_locked(batch, now)
+            return len(batch), expired, notified, {eq_id for _, eq_id in batch}
+
+    # some machine is busy: go machine by machine and skip only the busy ones
+    expired = notified = 0
+    touched = set()
+    by_equipment = {}
+    for pk, eq_id in batch:
+        by_equipment.setdefault(eq_id, []).append((pk, eq_id))
+    for eq_id, rows in sorted(by_equipment.items()):
+        with equipment_lock(eq_id, blocking=False) as acquired:
+            if not acquired:
+                skipped_ids.update(pk for pk, _ in rows)
+                continue
+            n_expired, n_notified = _expire_locked(rows, now)
+        expired += n_expired
+        notified += n_notified
+        touched.add(eq_id)
+    return len(batch), expired, notified, touched
+
+
+def _expire_locked(batch, now) -> Tuple[int, int]:
+    """Expire the (row-locked) reservations in `batch` and promote replacements."""
+    Reservation.objects.filter(pk__in=[pk for pk, _ in batch]).update(status='EXPIRED')
+    expired_per_equipment = Counter(eq_id for _, eq_id in batch)
+    record_no_shows(expired_per_equipment)
+    promoted = bulk_promote_heads(expired_per_equipment, now=now)
+    return len(batch), sum(promoted.values())
+
+
+def release_equipment(equipment: Equipment, now=None):
+    """Mark the (row-locked) equipment AVAILABLE and notify the head of its queue."""
+    if now is None:
+        now = timezone.now()
+
+    equipment.status = 'AVAILABLE'
+    equipment.busy_until = None
+    equipment.save(update_fields=['status', 'busy_until'])
+
+    bulk_promote_heads({equipment.pk: 1}, now=now)
+
+    notify_equipment_change(equipment)
+    return equipment
+
+
+def expire_notified(
+    timeout_minutes: Optional[float] = None,
+    batch_size: int = 50,
+    max_seconds: Optional[float] = None,
+    dry_run: bool = False,
+    reservation_ids=None,
+) -> Dict[str, int]:
+    """
+    Expire overdue notifications and promote the next heads, one short
+    transaction per batch (skip_locked, so concurrent runners split the
+    backlog). Stops once `max_seconds` is spent; the rest is picked up by the
+    next run. Equipment updates are published after each batch commits.
+
+    dry_run only counts what is overdue. Returns
+    {'expired', 'notified', 'batches', 'remaining'}; 'remaining' counts the
+    overdue rows left behind (time budget spent, machine busy, or dry_run).
+    """
+    cutoff = notification_cutoff(timeout_minutes)
+    overdue = Reservation.objects.filter(status='NOTIFIED', notified_at__lt=cutoff)
+    if reservation_ids is not None:
+        overdue = overdue.filter(pk__in=reservation_ids)
+
+    result = {'expired': 0, 'notified': 0, 'batches': 0, 'remaining': 0}
+    if dry_run:
+        result['remaining'] = overdue.count()
+        return result
+
+    started = time.monotonic()
+    skipped_ids = set()
+    while True:
+        if max_seconds is not None and time.monotonic() - started >= max_seconds:
+            result['remaining'] = overdue.count()
+            logger.info("Expiry stopped after %.1fs budget: %s", max_seconds, result)
+            break
+        with transaction.atomic():
+            found, expired, notified, touched_eq_ids = bulk_expire_notified(
+                cutoff, batch_size=batch_size, reservation_ids=reservation_ids, skipped_ids=skipped_ids
+            )
+            if not found:
+                # nothing overdue left that another runner is not already handling
+                result['remaining'] = len(skipped_ids)
+                break
+
+            def _emit(ids):
+                for eq_id in ids:
+                    publish_equipment_update_by_id(eq_id)
+
+            transaction.on_commit(lambda ids=list(touched_eq_ids): _emit(ids))
+        result['expired'] += expired
+        result['notified'] += notified
+        result['batches'] += 1
+    return result
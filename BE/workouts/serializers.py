@@ -2,6 +2,8 @@
 
 from rest_framework import serializers
 from .models import UsageSession, Reservation
+from .eta import estimate_wait_seconds
+from .session_management import get_queue_position
 from django.utils import timezone
 from django.conf import settings
 from datetime import timedelta
@@ -41,6 +43,7 @@ class ReservationSerializer(serializers.ModelSerializer):
     # Queue-related fields
     waiting_position = serializers.SerializerMethodField()
     waiting_count = serializers.SerializerMethodField()
+    estimated_wait_seconds = serializers.SerializerMethodField()
 
     def get_equipment_id(self, obj):
         return obj.equipment.id if obj.equipment else None
@@ -53,28 +56,32 @@ class ReservationSerializer(serializers.ModelSerializer):
         return getattr(obj.equipment, 'base_session_time_minutes', None)
 
     def get_waiting_count(self, obj):
-        return Reservation.objects.filter(equipment=obj.equipment, status='WAITING').count()
+        # denormalized counter maintained on Equipment (no COUNT query)
+        return obj.equipment.waiting_count if obj.equipment else 0
 
     def get_waiting_position(self, obj):
-        # If user has been notified, treat as position 1
+        # NOTIFIED -> 1, WAITING -> tickets ahead + 1, otherwise None
+        if hasattr(obj, 'waiting_position'):
+            # annotated by ReservationViewSet.get_queryset
+            return obj.waiting_position
+        return get_queue_position(obj)
+
+    def get_estimated_wait_seconds(self, obj):
+        # computed from counters on the equipment row, no history scan
         if obj.status == 'NOTIFIED':
-            return 1
-
-        # Build ordered waiting list and find index
-        waiting_qs = Reservation.objects.filter(equipment=obj.equipment, status='WAITING').order_by('created_at')
-        waiting_list = list(waiting_qs)
-        try:
-            return waiting_list.index(obj) + 1
-        except ValueError:
-            # Not in waiting list (maybe status changed)
+            return 0
+        if obj.status != 'WAITING' or not obj.equipment:
             return None
+        return estimate_wait_seconds(obj.equipment, self.get_waiting_position(obj))
 
     class Meta:
         model = Reservation
         fields = (
             'id', 'user', 'equipment', 'equipment_id', 'equipment_image', 'equipment_allocated_time',
-            'created_at', 'status', 'notified_at', 'waiting_position', 'waiting_count'
+            'created_at', 'status', 'notified_at', 'ticket', 'claim_group', 'waiting_position', 'waiting_count',
+            'estimated_wait_seconds',
         )
+        read_only_fields = ('ticket', 'claim_group')
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
@@ -1,57 +1,208 @@
 import logging
 from datetime import timedelta
-from typing import Optional
+from typing import Dict, Optional, Tuple
 
 from django.conf import settings
 from django.db import transaction
-from django.db.models import Q
+from django.db.models import (
+    Case, Count, DurationField, Exists, ExpressionWrapper, F, IntegerField, Max, OuterRef, Q, Subquery, Sum, Value,
+    When,
+)
+from django.db.models.functions import Coalesce, Greatest
 from django.utils import timezone
 
-from equipment.event_bus import publish_equipment_update
 from equipment.models import Equipment
 
+from .deadlines import SESSION_HEARTBEAT, retry_deadlines, schedule_session_heartbeat_deadline
+from .eta import record_session_end
+from .heartbeats import flush_heartbeats, forget_heartbeats, fresh_heartbeats
+from .locks import equipment_lock
 from .models import Reservation, UsageSession
+from .queue_engine import release_equipment
 
 logger = logging.getLogger(__name__)
 
 DEFAULT_HEARTBEAT_TIMEOUT_SECONDS = getattr(settings, "WORKOUT_HEARTBEAT_TIMEOUT_SECONDS", 45)
 DEFAULT_HEARTBEAT_START_GRACE_SECONDS = getattr(settings, "WORKOUT_HEARTBEAT_START_GRACE_SECONDS", 10)
 
+# lease name shared by run_session_sweeper and the expire_stale_sessions task
+STALE_SESSION_SWEEPER_LEASE = 'stale-session-sweeper'
 
-def notify_equipment_change(equipment: Optional[Equipment]):
-    if equipment is None:
+
+def waiting_delta(previous_status: Optional[str], new_status: Optional[str]) -> int:
+    """Change in the WAITING count caused by one reservation status transition."""
+    return int(new_status == 'WAITING') - int(previous_status == 'WAITING')
+
+
+def adjust_waiting_count(equipment_id, delta: int):
+    """
+    Apply a delta to the denormalized Equipment.waiting_count column.
+
+    Call it inside the same transaction as the reservation status change: the
+    UPDATE takes the equipment row lock, which is what keeps
+    reconcile_waiting_counts from overwriting an in-flight transition.
+    """
+    if not delta:
         return
+    Equipment.objects.filter(pk=equipment_id).update(
+        waiting_count=Greatest(F('waiting_count') + delta, 0)
+    )
 
-    def _emit():
-        publish_equipment_update(equipment)
 
-    transaction.on_commit(_emit)
+def get_waiting_count(equipment_id) -> int:
+    return Equipment.objects.filter(pk=equipment_id).values_list('waiting_count', flat=True).first() or 0
 
 
-def _release_equipment_to_available(equipment: Equipment, now=None):
-    if now is None:
-        now = timezone.now()
+def get_queue_position(reservation: Reservation, served_ticket: Optional[int] = None) -> Optional[int]:
+    """
+    1-based position of a reservation in its equipment queue (NOTIFIED counts
+    as 1, finished reservations have none).
+
+    Every WAITING ticket is above the equipment's served-ticket cursor, so the
+    people ahead are an indexed range count over (served_ticket, ticket)
+    instead of loading the whole queue.
+    """
+    if reservation.status == 'NOTIFIED':
+        return 1
+    if reservation.status != 'WAITING':
+        return None
+
+    waiting = Reservation.objects.filter(equipment_id=reservation.equipment_id, status='WAITING')
+    if reservation.ticket is None:
+        # rows created outside the ticketed join path
+        return waiting.filter(created_at__lt=reservation.created_at).count() + 1
+
+    if served_ticket is None:
+        served_ticket = reservation.equipment.served_ticket
+    ahead = waiting.filter(ticket__gt=served_ticket, ticket__lt=reservation.ticket).count()
+    return ahead + 1
+
 
-    equipment.status = 'AVAILABLE'
-    equipment.save()
+def check_queue_admission(equipment_id, user, notified_cutoff) -> Tuple[bool, Optional[int], int]:
+    """
+    Decide whether `user` may start on the equipment, in one aggregate query.
 
-    next_waiting = (
-        Reservation.objects.select_for_update(skip_locked=True)
-        .filter(equipment=equipment, status='WAITING')
-        .order_by('created_at')
-        .first()
+    Returns (others_in_queue, own_notified_id, stale_notified):
+    - others_in_queue: another user is WAITING or holds a live notification
+    - own_notified_id: the user's live NOTIFIED reservation, if any
+    - stale_notified: NOTIFIED rows older than the cutoff (to be expired)
+
+    Call it while holding the equipment row lock.
+    """
+    live_notified = Q(status='NOTIFIED', notified_at__gte=notified_cutoff)
+    row = Reservation.objects.filter(
+        equipment_id=equipment_id, status__in=('WAITING', 'NOTIFIED')
+    ).aggregate(
+        others=Count('pk', filter=~Q(user=user) & (Q(status='WAITING') | live_notified)),
+        own_id=Max('pk', filter=Q(user=user) & live_notified),
+        stale=Count('pk', filter=Q(status='NOTIFIED', notified_at__lt=notified_cutoff)),
+    )
+    return bool(row['others']), row['own_id'], row['stale'] or 0
+
+
+def reconcile_waiting_counts() -> int:
+    """
+    Repair drift between Equipment.waiting_count and the actual number of
+    WAITING reservations (e.g. rows changed through the admin or deleted by
+    cascade). Returns the number of equipment rows corrected.
+    """
+    drifted = (
+        Equipment.objects.annotate(
+            actual=Count('reservation', filter=Q(reservation__status='WAITING'))
+        )
+        .exclude(waiting_count=F('actual'))
+        .values_list('pk', flat=True)
     )
 
-    if next_waiting:
-        next_waiting.status = 'NOTIFIED'
-        next_waiting.notified_at = now
-        next_waiting.save()
+    repaired = 0
+    for equipment_id in list(drifted):
+        with transaction.atomic():
+            # recount under the row lock so a concurrent transition is not lost
+            equipment = Equipment.objects.select_for_update().filter(pk=equipment_id).first()
+            if equipment is None:
+                continue
+            actual = Reservation.objects.filter(equipment_id=equipment_id, status='WAITING').count()
+            if equipment.waiting_count != actual:
+                logger.warning(
+                    "Repairing waiting_count drift on equipment %s: %s -> %s",
+                    equipment_id,
+                    equipment.waiting_count,
+                    actual,
+                )
+                Equipment.objects.filter(pk=equipment_id).update(waiting_count=actual)
+                repaired += 1
+    return repaired
+
+
+def annotate_queue_position(queryset):
+    """
+    Annotate `waiting_position` on a Reservation queryset with the same rules
+    as get_queue_position, computed by the database in the list query itself.
+
+    The people ahead are a correlated COUNT over the (equipment, status,
+    ticket) index. A ROW_NUMBER() window cannot be used here because the list
+    is filtered to one user before the window would be evaluated.
+    """
+    def _ahead(**bounds):
+        return Subquery(
+            Reservation.objects.filter(
+                equipment_id=OuterRef('equipment_id'),
+                status='WAITING',
+                **bounds,
+            )
+            .order_by()
+            .values('equipment_id')
+            .annotate(ahead=Count('pk'))
+            .values('ahead'),
+            output_field=IntegerField(),
+        )
 
-    notify_equipment_change(equipment)
-    return equipment
+    ticket_ahead = _ahead(
+        ticket__gt=OuterRef('equipment__served_ticket'),
+        ticket__lt=OuterRef('ticket'),
+    )
+    created_ahead = _ahead(created_at__lt=OuterRef('created_at'))
+
+    return queryset.annotate(
+        waiting_position=Case(
+            When(status='NOTIFIED', then=Value(1)),
+            When(status='WAITING', ticket__isnull=False, then=Coalesce(ticket_ahead, 0) + 1),
+            When(status='WAITING', then=Coalesce(created_ahead, 0) + 1),
+            default=None,
+            output_field=IntegerField(),
+        )
+    )
+
+
+def recent_body_part_ratios(user, now=None, hours: int = 24) -> Dict[str, float]:
+    """
+    Upper/lower-body share of the user's finished sessions in the last `hours`,
+    as the AI recommendation features. One aggregate over the
+    (user, start_time) index joined to equipment.body_part.
+    """
+    if now is None:
+        now = timezone.now()
+    duration = ExpressionWrapper(F('end_time') - F('start_time'), output_field=DurationField())
+    totals = UsageSession.objects.filter(
+        user=user,
+        start_time__gte=now - timedelta(hours=hours),
+        end_time__isnull=False,
+    ).aggregate(
+        total=Sum(duration),
+        upper=Sum(duration, filter=Q(equipment__body_part='UPPER')),
+        lower=Sum(duration, filter=Q(equipment__body_part='LOWER')),
+    )
+    total = totals['total'].total_seconds() if totals['total'] else 0
+    if total <= 0:
+        return {'upper_ratio': 0, 'lower_ratio': 0}
+    return {
+        'upper_ratio': (totals['upper'] or timedelta()).total_seconds() / total,
+        'lower_ratio': (totals['lower'] or timedelta()).total_seconds() / total,
+    }
 
 
 def finalize_session(session: UsageSession, now=None, *, reason: Optional[str] = None) -> Optional[Equipment]:
+    """End the session and release its equipment. The caller holds equipment_lock(session.equipment_id)."""
     if now is None:
         now = timezone.now()
 
@@ -60,9 +211,11 @@ def finalize_session(session: UsageSession, now=None, *, reason: Optional[str] =
 
     session.end_time = now
     session.save()
+    forget_heartbeats([session.pk])
+    record_session_end(session, now=now)
 
     equipment = Equipment.objects.select_for_update().get(pk=session.equipment.pk)
-    released = _release_equipment_to_available(equipment, now=now)
+    released = release_equipment(equipment, now=now)
     logger.info(
         "Finalized session %s (equipment %s) reason=%s",
         session.pk,
@@ -72,27 +225,119 @@ def finalize_session(session: UsageSession, now=None, *, reason: Optional[str] =
     return released
 
 
-def cleanup_stale_sessions(timeout_seconds: Optional[int] = None, grace_seconds: Optional[int] = None, batch_size: int = 20) -> int:
+def stuck_in_use_equipment(queryset=None):
+    """
+    Equipment marked IN_USE without any open UsageSession, as a single
+    NOT EXISTS anti-join backed by the partial unique (equipment) WHERE
+    end_time IS NULL index. Shared by the stale-session sweeper and the operator report.
+    """
+    if queryset is None:
+        queryset = Equipment.objects.all()
+    open_sessions = UsageSession.objects.filter(equipment_id=OuterRef('pk'), end_time__isnull=True)
+    return queryset.filter(status='IN_USE').alias(has_open_session=Exists(open_sessions)).filter(has_open_session=False)
+
+
+def stale_session_q(now=None, timeout_seconds: Optional[int] = None, grace_seconds: Optional[int] = None) -> Q:
+    """Open sessions whose heartbeat (or start, if none yet) is past the timeout."""
+    if now is None:
+        now = timezone.now()
     if timeout_seconds is None:
         timeout_seconds = DEFAULT_HEARTBEAT_TIMEOUT_SECONDS
     if grace_seconds is None:
         grace_seconds = DEFAULT_HEARTBEAT_START_GRACE_SECONDS
 
-    now = timezone.now()
     cutoff = now - timedelta(seconds=timeout_seconds)
     start_cutoff = now - timedelta(seconds=timeout_seconds + grace_seconds)
+    return Q(end_time__isnull=True) & (
+        Q(last_heartbeat__lt=cutoff)
+        | (Q(last_heartbeat__isnull=True) & Q(start_time__lt=start_cutoff))
+    )
+
+
+def finalize_overdue_heartbeat_sessions(session_ids) -> int:
+    """
+    Deadline handler: end the given sessions if their heartbeat really timed
+    out, otherwise re-register their (moved) deadline. Sessions that could not
+    be handled now (row locked elsewhere, equipment busy, failure) are retried
+    shortly. Returns sessions ended.
+    """
+    ended = 0
+    with transaction.atomic():
+        sessions = list(
+            UsageSession.objects.select_for_update(skip_locked=True)
+            .filter(pk__in=session_ids, end_time__isnull=True)
+        )
+        locked_elsewhere = set(
+            UsageSession.objects.filter(pk__in=session_ids, end_time__isnull=True)
+            .exclude(pk__in=[s.pk for s in sessions])
+            .values_list('pk', flat=True)
+        )
+        retry_ids = set(locked_elsewhere)
+        stale_ids = set(
+            UsageSession.objects.filter(pk__in=[s.pk for s in sessions]).filter(stale_session_q()).values_list('pk', flat=True)
+        )
+        # the DB heartbeat may lag the fast store by one flush interval
+        fresh = fresh_heartbeats(stale_ids)
+        for session in sessions:
+            latest = fresh.get(session.pk) or session.last_heartbeat or session.start_time
+            if session.pk not in stale_ids or session.pk in fresh:
+                schedule_session_heartbeat_deadline(session.pk, latest)
+                continue
+            try:
+                # row locks are already held: never wait for the equipment key
+                with equipment_lock(session.equipment_id, blocking=False) as acquired:
+                    if not acquired:
+                        retry_ids.add(session.pk)
+                        continue
+                    finalize_session(session, now=timezone.now(), reason='heartbeat_timeout')
+            except Exception as exc:
+                logger.exception("Failed to finalize stale session %s", session.pk, exc_info=exc)
+                retry_ids.add(session.pk)
+                continue
+            ended += 1
+        if retry_ids:
+            retry_deadlines(SESSION_HEARTBEAT, retry_ids)
+    return ended
+
+
+def cleanup_stale_sessions(
+    timeout_seconds: Optional[int] = None,
+    grace_seconds: Optional[int] = None,
+    batch_size: int = 20,
+    lease=None,
+) -> int:
+    """
+    End stale sessions and release equipment stuck in IN_USE, in batches.
+    When run under a `lease` (leases.Lease), the lease is renewed before every
+    batch and the sweep stops as soon as it is lost, so a long sweep never
+    overlaps with the next leader's.
+    """
     cleaned = 0
 
+    def _still_leader():
+        if lease is None or lease.acquire():
+            return True
+        logger.warning("Lost lease %s mid-sweep; stopping after %s cleaned", lease.key, cleaned)
+        return False
+
+    # persist buffered pings first so the DB view is at most moments old
+    try:
+        flush_heartbeats()
+    except Exception:
+        logger.exception("Failed to flush heartbeats before stale-session sweep")
+    alive_ids = set()
+    # busy (equipment key held elsewhere) or failed; retried on the next run
+    skipped_ids = set()
+
     # Ensure equipments stuck in IN_USE without sessions get released as well.
     while True:
+        if not _still_leader():
+            return cleaned
         with transaction.atomic():
             qs = (
                 UsageSession.objects.select_for_update(skip_locked=True)
-                .filter(end_time__isnull=True)
-                .filter(
-                    Q(last_heartbeat__lt=cutoff)
-                    | (Q(last_heartbeat__isnull=True) & Q(start_time__lt=start_cutoff))
-                )
+                .filter(stale_session_q(timeout_seconds=timeout_seconds, grace_seconds=grace_seconds))
+                .exclude(pk__in=alive_ids | skipped_ids)
                 .order_by('last_heartbeat')[:batch_size]
             )
 
@@ -100,24 +345,32 @@ def cleanup_stale_sessions(timeout_seconds: Optional[int] = None, grace_seconds:
             if not sessions:
                 break
 
+            fresh = fresh_heartbeats([s.pk for s in sessions], timeout_seconds=timeout_seconds)
+            alive_ids.update(fresh)
+
             for session in sessions:
+                if session.pk in fresh:
+                    continue
                 try:
-                    finalize_session(session, now=timezone.now(), reason='heartbeat_timeout')
+                    with equipment_lock(session.equipment_id, blocking=False) as acquired:
+                        if not acquired:
+                            skipped_ids.add(session.pk)
+                            continue
+                        finalize_session(session, now=timezone.now(), reason='heartbeat_timeout')
                 except Exception as exc:
                     logger.exception("Failed to finalize stale session %s", session.pk, exc_info=exc)
+                    skipped_ids.add(session.pk)
                     continue
                 cleaned += 1
 
+    failed_equipment_ids = set()
     while True:
+        if not _still_leader():
+            return cleaned
         with transaction.atomic():
-            active_equipment_ids = list(
-                UsageSession.objects.filter(end_time__isnull=True).values_list('equipment_id', flat=True)
-            )
-            stuck_qs = (
-                Equipment.objects.select_for_update(skip_locked=True)
-                .filter(status='IN_USE')
-                .exclude(pk__in=active_equipment_ids)
-            )[:batch_size]
+            stuck_qs = stuck_in_use_equipment(
+                Equipment.objects.select_for_update(skip_locked=True).exclude(pk__in=failed_equipment_ids)
+            ).order_by('pk')[:batch_size]
 
             stuck_equipment = list(stuck_qs)
             if not stuck_equipment:
@@ -125,13 +378,18 @@ def cleanup_stale_sessions(timeout_seconds: Optional[int] = None, grace_seconds:
 
             for equipment in stuck_equipment:
                 try:
-                    _release_equipment_to_available(equipment, now=timezone.now())
+                    with equipment_lock(equipment.pk, blocking=False) as acquired:
+                        if not acquired:
+                            failed_equipment_ids.add(equipment.pk)
+                            continue
+                        release_equipment(equipment, now=timezone.now())
                     logger.info(
                         "Released stuck IN_USE equipment %s without active session",
                         equipment.pk,
                     )
                 except Exception as exc:
                     logger.exception("Failed to release stuck equipment %s", equipment.pk, exc_info=exc)
+                    failed_equipment_ids.add(equipment.pk)
                     continue
                 cleaned += 1
 
@@ -1,71 +1,30 @@
 from celery import shared_task
 from django.utils import timezone
 from django.db import transaction
-from datetime import timedelta
-from .models import Reservation, UsageSession
-from .session_management import cleanup_stale_sessions, finalize_session
-from equipment.event_bus import publish_equipment_update_by_id
+from .models import UsageSession
+from .archival import archive_history as _archive_history
+from .heartbeats import flush_heartbeats as _flush_heartbeats
+from .leases import Lease
+from .locks import equipment_lock
+from .queue_engine import expire_notified
+from .session_management import (
+    cleanup_stale_sessions,
+    finalize_session,
+    reconcile_waiting_counts as _reconcile_waiting_counts,
+    STALE_SESSION_SWEEPER_LEASE,
+)
 from typing import Optional
 
 
-from .constants import DEFAULT_NOTIFICATION_TIMEOUT_MINUTES
-
-
 @shared_task(bind=True)
-def expire_notified_reservations(self, timeout_minutes: float = None, batch_size: int = 50):
+def expire_notified_reservations(
+    self, timeout_minutes: float = None, batch_size: int = 50, max_seconds: Optional[float] = None
+):
     """
     Expire NOTIFIED reservations older than timeout_minutes and notify next waiting users.
-    This task is intended to be run periodically (or scheduled per-reservation).
+    Same engine as the `expire_reservations` management command (queue_engine.expire_notified).
     """
-    # Use the module-level DEFAULT_NOTIFICATION_TIMEOUT_MINUTES when caller doesn't pass a value
-    if timeout_minutes is None:
-        timeout_minutes = DEFAULT_NOTIFICATION_TIMEOUT_MINUTES
-    cutoff = timezone.now() - timedelta(minutes=timeout_minutes)
-    expired_total = 0
-    notified_total = 0
-
-    # Batch processing with select_for_update(skip_locked=True) for safety
-    while True:
-        with transaction.atomic():
-            qs = (
-                Reservation.objects.select_for_update(skip_locked=True)
-                .filter(status='NOTIFIED', notified_at__lt=cutoff)
-                .order_by('notified_at')[:batch_size]
-            )
-
-            reservations = list(qs)
-            if not reservations:
-                break
-
-            touched_eq_ids = set()
-            for r in reservations:
-                r.status = 'EXPIRED'
-                r.save()
-                expired_total += 1
-                touched_eq_ids.add(r.equipment_id)
-
-                # notify next waiting
-                next_r = (
-                    Reservation.objects.filter(equipment=r.equipment, status='WAITING')
-                    .order_by('created_at')
-                    .first()
-                )
-                if next_r:
-                    next_r.status = 'NOTIFIED'
-                    next_r.notified_at = timezone.now()
-                    next_r.save()
-                    notified_total += 1
-                    touched_eq_ids.add(next_r.equipment_id)
-                    # TODO: enqueue/send FCM push notification for next_r.user
-
-            if touched_eq_ids:
-                def _emit(ids):
-                    for eq_id in ids:
-                        publish_equipment_update_by_id(eq_id)
-
-                transaction.on_commit(lambda ids=list(touched_eq_ids): _emit(ids))
-
-    return {'expired': expired_total, 'notified': notified_total}
+    return expire_notified(timeout_minutes=timeout_minutes, batch_size=batch_size, max_seconds=max_seconds)
 
 
 @shared_task(bind=True)
@@ -77,18 +36,21 @@ def expire_active_sessions(self, batch_size: int = 50):
     (if any) by moving one WAITING -> NOTIFIED and setting notified_at.
 
     This is intended to be run periodically (e.g. every 30s or 1min) via
-    Celery Beat.
+    Celery Beat. Only overdue rows are fetched (range query on the partial
+    expected_end_at index), so the cost follows the number of expirations.
     """
     now = timezone.now()
     ended = 0
     notified = 0
+    failed_ids = set()
 
     while True:
         with transaction.atomic():
             qs = (
                 UsageSession.objects.select_for_update(skip_locked=True)
-                .filter(end_time__isnull=True)
-                .order_by('start_time')[:batch_size]
+                .filter(end_time__isnull=True, expected_end_at__lte=now)
+                .exclude(pk__in=failed_ids)
+                .order_by('expected_end_at')[:batch_size]
             )
 
             sessions = list(qs)
@@ -97,12 +59,16 @@ def expire_active_sessions(self, batch_size: int = 50):
 
             for s in sessions:
                 try:
-                    expected_end = s.start_time + timedelta(minutes=s.allocated_duration_minutes)
-                    if expected_end <= now:
+                    # row locks are already held: never wait for the equipment key
+                    with equipment_lock(s.equipment_id, blocking=False) as acquired:
+                        if not acquired:
+                            failed_ids.add(s.pk)
+                            continue
                         finalize_session(s, now=now, reason='duration_expired')
-                        ended += 1
+                    ended += 1
                 except Exception:
-                    # if any row-specific error occurs, skip to next
+                    # if any row-specific error occurs, skip it on the next batches too
+                    failed_ids.add(s.pk)
                     continue
 
     return {'ended': ended, 'notified': notified}
@@ -110,6 +76,35 @@ def expire_active_sessions(self, batch_size: int = 50):
 
 @shared_task(bind=True)
 def expire_stale_sessions(self, timeout_seconds: Optional[int] = None, batch_size: int = 20):
-    """End sessions that have not sent a heartbeat within the configured timeout."""
-    cleaned = cleanup_stale_sessions(timeout_seconds=timeout_seconds, batch_size=batch_size)
+    """
+    End sessions that have not sent a heartbeat within the configured timeout.
+    Safety net for run_session_sweeper: skipped while another sweeper holds the lease.
+    """
+    lease = Lease(STALE_SESSION_SWEEPER_LEASE, ttl_seconds=60)
+    if not lease.acquire():
+        return {'cleaned': 0, 'skipped': True}
+    try:
+        cleaned = cleanup_stale_sessions(timeout_seconds=timeout_seconds, batch_size=batch_size, lease=lease)
+    finally:
+        lease.release()
     return {'cleaned': cleaned}
+
+
+@shared_task(bind=True)
+def reconcile_waiting_counts(self):
+    """Safety net that repairs drift in the denormalized Equipment.waiting_count."""
+    repaired = _reconcile_waiting_counts()
+    return {'repaired': repaired}
+
+
+@shared_task(bind=True)
+def flush_heartbeats(self):
+    """Persist buffered session heartbeats with one bulk UPDATE."""
+    written = _flush_heartbeats()
+    return {'written': written}
+
+
+@shared_task(bind=True)
+def archive_history(self, older_than_days: Optional[int] = None, batch_size: int = 500, max_seconds: Optional[float] = 600):
+    """Move old finished sessions / terminal reservations to the archive tables in bounded batches."""
+    return _archive_history(older_than_days=older_than_days, batch_size=batch_size, max_seconds=max_seconds)
@@ -1,3 +1,189 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
 from django.test import TestCase
+from rest_framework.test import APIClient
+
+from equipment.models import Equipment
+from gyms.models import Gym
+
+from . import idempotency
+from .models import Reservation, UsageSession
+
+
+class FakeRedis:
+    """The few Redis commands IdempotencyStore uses, kept in a dict."""
+
+    def __init__(self):
+        self.data = {}
+
+    def set(self, key, value, nx=False, px=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value.encode() if isinstance(value, str) else value
+        return True
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+class QueueTestCase(TestCase):
+    def setUp(self):
+        # deadlines are registered in Redis after commit; not under test here
+        patcher = mock.patch('workouts.deadlines.deadline_scheduler', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.owner = User.objects.create_user('owner', password='pw')
+        self.gym = Gym.objects.create(owner=self.owner, name='gym', address='addr')
+        self.users = [User.objects.create_user(f'user{i}', password='pw') for i in range(4)]
+
+    def make_equipment(self, name, status='AVAILABLE'):
+        return Equipment.objects.create(
+            gym=self.gym, name=name, type='STRENGTH', nfc_tag_id=f'nfc-{name}', arduino_id=f'ard-{name}', status=status
+        )
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def join(self, user, **data):
+        return self.client_for(user).post('/api/workouts/join-queue/', data, format='json')
+
+    def assertNoDrift(self, equipment):
+        equipment.refresh_from_db()
+        actual = Reservation.objects.filter(equipment=equipment, status='WAITING').count()
+        self.assertEqual(equipment.waiting_count, actual)
+        return equipment.waiting_count
+
+
+class JoinLeaveQueueTests(QueueTestCase):
+    def test_positions_and_waiting_count_follow_join_and_leave(self):
+        equipment = self.make_equipment('bench', status='IN_USE')
+
+        positions = [self.join(user, equipment_id=equipment.pk).data['position'] for user in self.users[:3]]
+        self.assertEqual(positions, [1, 2, 3])
+        self.assertEqual(self.assertNoDrift(equipment), 3)
+
+        response = self.client_for(self.users[1]).post(
+            '/api/workouts/leave-queue/', {'equipment_id': equipment.pk}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['waiting_count'], 2)
+        self.assertEqual(self.assertNoDrift(equipment), 2)
+
+        # the last one in line moved up past the user who left
+        response = self.join(self.users[2], equipment_id=equipment.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['position'], 2)
+
+    def test_leaving_the_notified_head_promotes_the_next_in_line(self):
+        equipment = self.make_equipment('squat', status='IN_USE')
+        first = self.join(self.users[0], equipment_id=equipment.pk).data['reservation_id']
+        second = self.join(self.users[1], equipment_id=equipment.pk).data['reservation_id']
+        Reservation.objects.filter(pk=first).update(status='NOTIFIED')
+        Equipment.objects.filter(pk=equipment.pk).update(waiting_count=1)
+
+        response = self.client_for(self.users[0]).post(
+            '/api/workouts/leave-queue/', {'reservation_id': first}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Reservation.objects.get(pk=second).status, 'NOTIFIED')
+        self.assertEqual(self.assertNoDrift(equipment), 0)
+
+    def test_duplicate_join_is_stopped_by_the_constraint(self):
+        equipment = self.make_equipment('row', status='IN_USE')
+        first = self.join(self.users[0], equipment_id=equipment.pk)
+        self.assertEqual(first.status_code, 201)
+
+        again = self.join(self.users[0], equipment_id=equipment.pk)
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again.data['reservation_id'], first.data['reservation_id'])
+        self.assertEqual(Reservation.objects.filter(user=self.users[0], equipment=equipment).count(), 1)
+        self.assertEqual(self.assertNoDrift(equipment), 1)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Reservation.objects.create(user=self.users[0], equipment=equipment, status='WAITING', ticket=99)
+
+    def test_join_racing_a_duplicate_returns_409(self):
+        equipment = self.make_equipment('press', status='IN_USE')
+        # the competing reservation is not visible yet when the constraint fires
+        with mock.patch('workouts.views.enqueue_reservation', side_effect=IntegrityError):
+            response = self.join(self.users[0], equipment_id=equipment.pk)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.assertNoDrift(equipment), 0)
+
+    def test_reservations_cannot_be_created_outside_join_queue(self):
+        equipment = self.make_equipment('curl')
+        response = self.client_for(self.users[0]).post(
+            '/api/reservations/', {'user': self.users[0].pk, 'equipment': equipment.pk, 'status': 'WAITING'}, format='json'
+        )
+        self.assertEqual(response.status_code, 405)
+        self.assertFalse(Reservation.objects.exists())
+
+
+class GroupClaimTests(QueueTestCase):
+    def test_release_promotes_group_head_and_expires_siblings(self):
+        first = self.make_equipment('treadmill-1', status='IN_USE')
+        second = self.make_equipment('treadmill-2', status='IN_USE')
+        for equipment, user in ((first, self.users[0]), (second, self.users[1])):
+            UsageSession.objects.create(user=user, equipment=equipment, allocated_duration_minutes=15)
+
+        response = self.join(self.users[2], equipment_ids=[first.pk, second.pk])
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(response.data['assigned'])
+        self.assertEqual(self.assertNoDrift(first), 1)
+        self.assertEqual(self.assertNoDrift(second), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client_for(self.users[0]).post('/api/workouts/end/')
+        self.assertEqual(response.status_code, 200)
+
+        claims = {r.equipment_id: r.status for r in Reservation.objects.filter(user=self.users[2])}
+        self.assertEqual(claims, {first.pk: 'NOTIFIED', second.pk: 'EXPIRED'})
+        self.assertEqual(self.assertNoDrift(first), 0)
+        self.assertEqual(self.assertNoDrift(second), 0)
+        first.refresh_from_db()
+        self.assertEqual(first.status, 'AVAILABLE')
+
+
+class StartSessionTests(QueueTestCase):
+    def test_second_open_session_on_equipment_returns_409(self):
+        equipment = self.make_equipment('bike')
+        UsageSession.objects.create(user=self.users[0], equipment=equipment, allocated_duration_minutes=15)
+
+        # the status says AVAILABLE, but session_one_open_per_equipment still holds
+        response = self.client_for(self.users[1]).post(
+            '/api/workouts/start/', {'equipment_id': equipment.pk}, format='json'
+        )
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(UsageSession.objects.filter(equipment=equipment, end_time__isnull=True).count(), 1)
+
+    def test_idempotency_key_replays_the_stored_response(self):
+        equipment = self.make_equipment('rower')
+        store = idempotency.IdempotencyStore('redis://unused', ttl_seconds=600)
+        store._client = FakeRedis()
+        client = self.client_for(self.users[0])
+
+        with mock.patch.object(idempotency, 'idempotency_store', store):
+            first = client.post(
+                '/api/workouts/start/', {'equipment_id': equipment.pk}, format='json', HTTP_IDEMPOTENCY_KEY='start-1'
+            )
+            replay = client.post(
+                '/api/workouts/start/', {'equipment_id': equipment.pk}, format='json', HTTP_IDEMPOTENCY_KEY='start-1'
+            )
+            other_body = client.post(
+                '/api/workouts/start/', {'equipment_id': equipment.pk + 1}, format='json', HTTP_IDEMPOTENCY_KEY='start-1'
+            )
 
-# Create your tests here.
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(replay.status_code, 201)
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(replay.data['id'], first.data['id'])
+        self.assertEqual(other_body.status_code, 422)
+        self.assertEqual(UsageSession.objects.filter(user=self.users[0]).count(), 1)
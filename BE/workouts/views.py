@@ -2,25 +2,47 @@ from django.shortcuts import render
 # workouts/views.py
 
 from rest_framework import viewsets, status
+from rest_framework.exceptions import ValidationError
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 # workouts/views.py (이 코드로 덮어쓰세요)
 from .models import UsageSession, Reservation
 from .serializers import UsageSessionSerializer, ReservationSerializer
-from .session_management import cleanup_stale_sessions, finalize_session, notify_equipment_change
+from .queue_engine import (
+    bulk_promote_heads,
+    enqueue_group,
+    enqueue_reservation,
+    notification_cutoff,
+    notify_equipment_change,
+    withdraw_sibling_claims,
+)
+from .session_management import (
+    adjust_waiting_count,
+    annotate_queue_position,
+    check_queue_admission,
+    finalize_session,
+    get_queue_position,
+    get_waiting_count,
+    recent_body_part_ratios,
+    waiting_delta,
+)
 from equipment.models import Equipment # Equipment 모델 import
 from users.models import UserProfile # UserProfile 모델 import
 from django.utils import timezone
-from django.conf import settings
-from django.db import transaction
-import datetime
+from django.db import IntegrityError, transaction
 import logging
+import time
 
 # "AI 두뇌 사용설명서"에서 예측 함수를 가져옵니다.
 # NOTE: Lazy import ai_model to avoid loading heavy ML dependencies at startup
 # from ai_model.prediction_utils import get_ai_recommendation
-from .constants import DEFAULT_NOTIFICATION_TIMEOUT_MINUTES
+from .constants import MAX_GROUP_JOIN_EQUIPMENT
+from .deadlines import schedule_session_heartbeat_deadline
+from .eta import estimate_wait_seconds, expected_free_at, record_no_shows, record_show
+from .heartbeats import record_heartbeat
+from .idempotency import idempotent
+from .locks import equipment_lock
 
 logger = logging.getLogger(__name__)
 
@@ -34,17 +56,56 @@ class ReservationViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated] # <- 이 줄 추가
     queryset = Reservation.objects.all()
     serializer_class = ReservationSerializer
+    # 예약 생성은 JoinQueueView(/workouts/join-queue/)만 허용합니다. 그래야 대기표 번호 발급과
+    # waiting_count 증가가 equipment_lock 아래에서 enqueue_reservation으로 처리됩니다.
+    http_method_names = ['get', 'put', 'patch', 'delete', 'head', 'options']
 
     def get_queryset(self):
         # Admin/staff can view all reservations; regular users only their own.
         user = self.request.user
-        if user.is_staff or user.is_superuser:
-            return Reservation.objects.all()
-        return Reservation.objects.filter(user=user)
+        qs = Reservation.objects.select_related('equipment', 'user')
+        if not (user.is_staff or user.is_superuser):
+            qs = qs.filter(user=user)
+        # waiting_position is computed in the same SQL statement and
+        # waiting_count comes from the joined equipment row, so the list costs
+        # a constant number of queries regardless of its length.
+        return annotate_queue_position(qs)
+
+    # Keep Equipment.waiting_count in step with status edits made through the API.
+    def perform_update(self, serializer):
+        new_equipment = serializer.validated_data.get('equipment')
+        try:
+            with equipment_lock(serializer.instance.equipment_id, getattr(new_equipment, 'pk', None)):
+                previous_status = serializer.instance.status
+                reservation = serializer.save()
+                adjust_waiting_count(reservation.equipment_id, waiting_delta(previous_status, reservation.status))
+        except IntegrityError:
+            raise ValidationError({'error': '이 기구에 이미 대기/알림 상태인 예약이 있습니다.'})
+
+    def perform_destroy(self, instance):
+        with equipment_lock(instance.equipment_id):
+            adjust_waiting_count(instance.equipment_id, waiting_delta(instance.status, None))
+            instance.delete()
+
+def _open_session(user, equipment, allocated_time, session_type):
+    """Create the session row for equipment already claimed as IN_USE."""
+    session = UsageSession.objects.create(
+        user=user,
+        equipment=equipment,
+        allocated_duration_minutes=max(1, int(round(allocated_time))),
+        session_type=session_type,
+        last_heartbeat=timezone.now()
+    )
+    schedule_session_heartbeat_deadline(session.pk, session.last_heartbeat)
+    equipment.busy_until = expected_free_at(equipment, session.start_time, session.allocated_duration_minutes)
+    Equipment.objects.filter(pk=equipment.pk).update(busy_until=equipment.busy_until)
+    return session
+
 
 class StartSessionView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @idempotent('start')
     def post(self, request, *args, **kwargs):
         nfc_tag_id = request.data.get('nfc_tag_id')
         equipment_id = request.data.get('equipment_id')
@@ -53,16 +114,25 @@ class StartSessionView(APIView):
         if not nfc_tag_id and not equipment_id:
             return Response({'error': 'nfc_tag_id 또는 equipment_id 중 하나가 필요합니다.'}, status=status.HTTP_400_BAD_REQUEST)
 
+        notified_cutoff = notification_cutoff()
+        if not equipment_id:
+            equipment_id = Equipment.objects.filter(nfc_tag_id=nfc_tag_id).values_list('pk', flat=True).first()
         try:
-            if equipment_id:
-                equipment = Equipment.objects.get(id=equipment_id)
-            else:
-                equipment = Equipment.objects.get(nfc_tag_id=nfc_tag_id)
-        except Equipment.DoesNotExist:
+            equipment_id = int(equipment_id)
+        except (TypeError, ValueError):
             return Response({'error': '해당 기구를 찾을 수 없습니다.'}, status=status.HTTP_404_NOT_FOUND)
-
-        with transaction.atomic():
-            equipment = Equipment.objects.select_for_update().get(pk=equipment.pk)
+        # 진행 중인 세션의 기구도 함께 잠급니다 (기구 id 오름차순, 행 잠금보다 먼저).
+        open_equipment_ids = list(
+            UsageSession.objects.filter(user=user, end_time__isnull=True).values_list('equipment_id', flat=True)
+        )
+
+        # 입장 판단은 기구 잠금 하나 + 대기열 집계 쿼리 하나로 끝냅니다.
+        session = None
+        with equipment_lock(equipment_id, *open_equipment_ids):
+            try:
+                equipment = Equipment.objects.select_for_update().get(pk=equipment_id)
+            except Equipment.DoesNotExist:
+                return Response({'error': '해당 기구를 찾을 수 없습니다.'}, status=status.HTTP_404_NOT_FOUND)
 
             if equipment.status != 'AVAILABLE':
                 return Response({'error': '현재 사용할 수 없는 기구입니다.'}, status=status.HTTP_409_CONFLICT)
@@ -76,67 +146,51 @@ class StartSessionView(APIView):
                     user.username,
                 )
 
-            minutes_default = getattr(settings, 'WORKOUT_NOTIFICATION_TIMEOUT_MINUTES', None)
-            if minutes_default is None:
-                minutes_default = DEFAULT_NOTIFICATION_TIMEOUT_MINUTES
-            try:
-                minutes_default = float(minutes_default)
-            except Exception:
-                minutes_default = DEFAULT_NOTIFICATION_TIMEOUT_MINUTES or 0.25
-
-            notified_cutoff = timezone.now() - datetime.timedelta(minutes=minutes_default)
+            other_in_queue, reservation_id, stale_notified = check_queue_admission(equipment.pk, user, notified_cutoff)
 
-            stale_qs = Reservation.objects.select_for_update().filter(equipment=equipment, status='NOTIFIED', notified_at__lt=notified_cutoff)
-            if stale_qs.exists():
-                for stale in list(stale_qs):
-                    stale.status = 'EXPIRED'
-                    stale.save()
+            if stale_notified:
+                Reservation.objects.filter(
+                    equipment=equipment, status='NOTIFIED', notified_at__lt=notified_cutoff
+                ).update(status='EXPIRED')
+                record_no_shows({equipment.pk: stale_notified})
 
-            other_waiting = Reservation.objects.filter(equipment=equipment, status='WAITING').exclude(user=user).exists()
-            other_recent_notified = Reservation.objects.filter(equipment=equipment, status='NOTIFIED', notified_at__gte=notified_cutoff).exclude(user=user).exists()
-            other_in_queue = other_waiting or other_recent_notified
+            if reservation_id is not None:
+                # conditional UPDATE instead of locking and re-reading the reservation
+                if Reservation.objects.filter(pk=reservation_id, status='NOTIFIED').update(status='COMPLETED'):
+                    record_show(equipment.pk)
+                else:
+                    reservation_id = None
 
-            reservation = Reservation.objects.select_for_update().filter(equipment=equipment, user=user, status='NOTIFIED', notified_at__gte=notified_cutoff).first()
-            if other_in_queue and not reservation:
+            if other_in_queue and reservation_id is None:
                 return Response({'error': '대기열이 있습니다. 알림 받은 사용자만 시작할 수 있습니다.'}, status=status.HTTP_409_CONFLICT)
 
-        allocated_time = equipment.base_session_time_minutes
-        session_type = ''
+            if reservation_id is not None:
+                # 알림 받은 사용자는 AI 추천이 필요 없으므로 같은 잠금 안에서 바로 시작합니다.
+                try:
+                    equipment.status = 'IN_USE'
+                    equipment.save(update_fields=['status'])
+                    notify_equipment_change(equipment)
+                    session = _open_session(user, equipment, equipment.base_session_time_minutes, 'BASE')
+                except IntegrityError:
+                    # session_one_open_per_equipment: the machine already has an open session
+                    transaction.set_rollback(True)
+                    return Response({'error': '기구가 사용 불가 상태입니다.'}, status=status.HTTP_409_CONFLICT)
+                except Exception:
+                    logger.exception("Failed to create UsageSession or update Equipment status")
+                    transaction.set_rollback(True)
+                    return Response({'error': '서버 에러: 세션 생성 실패'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        if reservation:
+        if session is None:
             allocated_time = equipment.base_session_time_minutes
-            session_type = 'BASE'
-            reservation.status = 'COMPLETED'
-            reservation.save()
-        else:
+            session_type = ''
+
             try:
                 from ai_model.prediction_utils import get_ai_recommendation
 
                 user_profile = UserProfile.objects.get(user=user)
 
-                now = timezone.now()
-                recent_sessions = UsageSession.objects.filter(
-                    user=user,
-                    start_time__gte=now - datetime.timedelta(hours=24),
-                    end_time__isnull=False,
-                )
-
-                total_duration_minutes = 0
-                upper_duration_minutes = 0
-                lower_duration_minutes = 0
-
-                for session in recent_sessions:
-                    duration = (session.end_time - session.start_time).total_seconds() / 60
-                    total_duration_minutes += duration
-                    if session.equipment.body_part == 'UPPER':
-                        upper_duration_minutes += duration
-                    elif session.equipment.body_part == 'LOWER':
-                        lower_duration_minutes += duration
-
-                upper_ratio = (upper_duration_minutes / total_duration_minutes) if total_duration_minutes > 0 else 0
-                lower_ratio = (lower_duration_minutes / total_duration_minutes) if total_duration_minutes > 0 else 0
-
-                ratios = {'upper_ratio': upper_ratio, 'lower_ratio': lower_ratio}
+                # 최근 24시간 상체/하체 비율 (단일 집계 쿼리)
+                ratios = recent_body_part_ratios(user)
 
                 allocated_time = get_ai_recommendation(
                     user_profile,
@@ -160,31 +214,23 @@ class StartSessionView(APIView):
                 allocated_time = equipment.base_session_time_minutes
                 session_type = 'BASE'
 
-        allocated_time = max(1, int(round(allocated_time)))
-
-        try:
-            with transaction.atomic():
-                equipment = Equipment.objects.select_for_update().get(pk=equipment.pk)
-                if equipment.status != 'AVAILABLE' and not reservation:
-                    logger.warning(
-                        f"Equipment {equipment.pk} not available at commit time: {equipment.status}"
-                    )
-                    return Response({'error': '기구가 사용 불가 상태입니다.'}, status=status.HTTP_409_CONFLICT)
-
-                equipment.status = 'IN_USE'
-                equipment.save()
-                notify_equipment_change(equipment)
-
-                session = UsageSession.objects.create(
-                    user=user,
-                    equipment=equipment,
-                    allocated_duration_minutes=allocated_time,
-                    session_type=session_type,
-                    last_heartbeat=timezone.now()
-                )
-        except Exception as e:
-            logger.exception("Failed to create UsageSession or update Equipment status")
-            return Response({'error': '서버 에러: 세션 생성 실패'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            try:
+                with equipment_lock(equipment.pk):
+                    # claim with one conditional UPDATE rather than re-locking the row
+                    claimed = Equipment.objects.filter(pk=equipment.pk, status='AVAILABLE').update(status='IN_USE')
+                    if not claimed:
+                        logger.warning("Equipment %s not available at commit time", equipment.pk)
+                        return Response({'error': '기구가 사용 불가 상태입니다.'}, status=status.HTTP_409_CONFLICT)
+                    equipment.status = 'IN_USE'
+                    notify_equipment_change(equipment)
+                    session = _open_session(user, equipment, allocated_time, session_type)
+            except IntegrityError:
+                # one open session per user / per equipment (partial unique constraints)
+                logger.warning("Concurrent session start rejected for equipment %s", equipment.pk)
+                return Response({'error': '기구가 사용 불가 상태입니다.'}, status=status.HTTP_409_CONFLICT)
+            except Exception:
+                logger.exception("Failed to create UsageSession or update Equipment status")
+                return Response({'error': '서버 에러: 세션 생성 실패'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
         serializer = UsageSessionSerializer(session)
         response_data = serializer.data
@@ -203,9 +249,13 @@ class EndSessionView(APIView):
 
     def post(self, request, *args, **kwargs):
         user = request.user
+        open_session = UsageSession.objects.filter(user=user, end_time__isnull=True).values_list('pk', 'equipment_id').first()
+        if open_session is None:
+            return Response({'error': '현재 진행 중인 운동 세션이 없습니다.'}, status=status.HTTP_404_NOT_FOUND)
+        session_id, session_equipment_id = open_session
         try:
-            with transaction.atomic():
-                current_session = UsageSession.objects.select_for_update().get(user=user, end_time__isnull=True)
+            with equipment_lock(session_equipment_id):
+                current_session = UsageSession.objects.select_for_update().get(pk=session_id, end_time__isnull=True)
                 finalize_session(current_session, now=timezone.now(), reason='user_end_session')
                 logger.info(
                     "User %s explicitly ended session %s",
@@ -223,23 +273,31 @@ class HeartbeatView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request, *args, **kwargs):
+        started = time.perf_counter()
         user = request.user
-        try:
-            with transaction.atomic():
-                session = UsageSession.objects.select_for_update().get(user=user, end_time__isnull=True)
-                session.last_heartbeat = timezone.now()
-                session.save()
-        except UsageSession.DoesNotExist:
+        # No row lock and no full-row save: the ping lands in the heartbeat
+        # store and is persisted by the batched flusher. Stale-session cleanup
+        # runs in the run_session_sweeper service, not on this request path.
+        session_id = UsageSession.objects.filter(user=user, end_time__isnull=True).values_list('pk', flat=True).first()
+        if session_id is None:
             logger.warning("Heartbeat skipped: no active session for user %s", user.username)
             return Response({'message': 'no active session'}, status=status.HTTP_200_OK)
 
-        cleanup_stale_sessions()
-        return Response({'message': 'heartbeat recorded'}, status=status.HTTP_200_OK)
+        now = record_heartbeat(session_id)
+        schedule_session_heartbeat_deadline(session_id, now)
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        logger.debug("heartbeat session=%s took %.2fms", session_id, elapsed_ms)
+        response = Response({'message': 'heartbeat recorded'}, status=status.HTTP_200_OK)
+        # exposes the handler time to clients/proxies for latency percentiles
+        response['Server-Timing'] = f'heartbeat;dur={elapsed_ms:.2f}'
+        return response
 
 
 class JoinQueueView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @idempotent('join')
     def post(self, request, *args, **kwargs):
         """
         현재 로그인한 사용자를 특정 기구의 대기열에 추가합니다.
@@ -249,8 +307,14 @@ class JoinQueueView(APIView):
 
         응답:
         { "reservation_id": 123, "equipment_id": 3, "position": 2, "waiting_count": 5 }
+
+        같은 종류 기구 중 먼저 비는 것 하나를 원하면 그룹으로 대기할 수 있습니다:
+        { "equipment_ids": [3, 4, 5] } 또는 { "gym_id": 1, "body_part": "LOWER", "type": "STRENGTH" }
         """
         user = request.user
+        if request.data.get('equipment_ids') is not None or request.data.get('gym_id') is not None:
+            return self._join_group(user, request.data)
+
         equipment_id = request.data.get('equipment_id')
 
         if equipment_id is None:
@@ -261,34 +325,130 @@ class JoinQueueView(APIView):
         except Equipment.DoesNotExist:
             return Response({'error': '해당 기구가 존재하지 않습니다.'}, status=status.HTTP_404_NOT_FOUND)
 
-        # 이미 대기열/알림 상태로 등록되어 있는지 확인
-        existing = Reservation.objects.filter(user=user, equipment=equipment, status__in=['WAITING', 'NOTIFIED']).first()
-        if existing:
-            # 이미 등록되어 있으면 현재 순번을 계산해 반환
-            if existing.status == 'NOTIFIED':
-                position = 1
-            else:
-                # 앞에 있는 WAITING 수 + 1
-                position = list(Reservation.objects.filter(equipment=equipment, status='WAITING').order_by('created_at')).index(existing) + 1
-            waiting_count = Reservation.objects.filter(equipment=equipment, status='WAITING').count()
-            return Response({'detail': '이미 대기열에 등록되어 있습니다.', 'reservation_id': existing.id, 'position': position, 'waiting_count': waiting_count}, status=status.HTTP_200_OK)
-
-        # 새 예약(대기) 생성
-        reservation = Reservation.objects.create(user=user, equipment=equipment, status='WAITING')
-
-        # 대기 중인 사람 수(생성 후 포함)
-        waiting_count = Reservation.objects.filter(equipment=equipment, status='WAITING').count()
-        # position은 대기열에서의 순번 (마지막에 추가되었으므로 waiting_count)
-        position = waiting_count
+        # 새 예약(대기) 생성: 대기표 발급 + 대기 인원 카운터 증가 (같은 트랜잭션).
+        # 중복 등록은 부분 유니크 제약(reservation_one_active_per_user_equipment)이 막으므로
+        # 미리 조회하지 않고, 위반 시 롤백 후 기존 예약을 돌려줍니다.
+        try:
+            with equipment_lock(equipment.pk):
+                # waiting_count는 대기 중인 사람 수(생성 후 포함)
+                reservation, waiting_count = enqueue_reservation(user, equipment)
+                # position은 대기열에서의 순번 (마지막에 추가되었으므로 waiting_count)
+                position = waiting_count
 
-        notify_equipment_change(equipment)
+                notify_equipment_change(equipment)
+        except IntegrityError:
+            existing = (
+                Reservation.objects.select_related('equipment')
+                .filter(user=user, equipment=equipment, status__in=['WAITING', 'NOTIFIED'])
+                .first()
+            )
+            if existing is None:
+                return Response({'error': '잠시 후 다시 시도해주세요.'}, status=status.HTTP_409_CONFLICT)
+            # 이미 등록되어 있으면 현재 순번을 계산해 반환 (앞에 있는 WAITING 수 + 1, NOTIFIED는 1)
+            position = get_queue_position(existing, served_ticket=existing.equipment.served_ticket)
+            waiting_count = existing.equipment.waiting_count
+            eta = 0 if existing.status == 'NOTIFIED' else estimate_wait_seconds(existing.equipment, position)
+            return Response({'detail': '이미 대기열에 등록되어 있습니다.', 'reservation_id': existing.id, 'position': position, 'waiting_count': waiting_count, 'estimated_wait_seconds': eta}, status=status.HTTP_200_OK)
+
+        eta = estimate_wait_seconds(equipment, position)
+        return Response({'reservation_id': reservation.id, 'equipment_id': equipment.id, 'position': position, 'waiting_count': waiting_count, 'estimated_wait_seconds': eta}, status=status.HTTP_201_CREATED)
+
+    def _join_group(self, user, data):
+        """
+        여러 기구에 하나의 논리적 대기표로 대기합니다. 지금 비어 있는 기구가 있으면
+        바로 그 기구로 알림(NOTIFIED) 배정하고, 없으면 각 기구에 대기한 뒤 먼저 비는
+        기구에서 알림을 받으며 나머지 대기는 자동으로 철회됩니다.
+        """
+        candidates = Equipment.objects.exclude(status='OUT_OF_ORDER').exclude(operational_state='MAINTENANCE')
+        equipment_ids = data.get('equipment_ids')
+        if equipment_ids is not None:
+            if not isinstance(equipment_ids, (list, tuple)) or not equipment_ids:
+                return Response({'error': 'equipment_ids는 기구 id 목록이어야 합니다.'}, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                candidates = candidates.filter(pk__in={int(eq_id) for eq_id in equipment_ids})
+            except (TypeError, ValueError):
+                return Response({'error': 'equipment_ids는 기구 id 목록이어야 합니다.'}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            body_part = data.get('body_part')
+            equipment_type = data.get('type')
+            if not body_part and not equipment_type:
+                return Response({'error': 'gym_id와 함께 body_part 또는 type을 제공해주세요.'}, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                candidates = candidates.filter(gym_id=int(data.get('gym_id')))
+            except (TypeError, ValueError):
+                return Response({'error': 'gym_id가 올바르지 않습니다.'}, status=status.HTTP_400_BAD_REQUEST)
+            if body_part:
+                candidates = candidates.filter(body_part=body_part)
+            if equipment_type:
+                candidates = candidates.filter(type=equipment_type)
+
+        candidate_ids = list(candidates.order_by('pk').values_list('pk', flat=True)[:MAX_GROUP_JOIN_EQUIPMENT])
+        if not candidate_ids:
+            return Response({'error': '조건에 맞는 기구가 없습니다.'}, status=status.HTTP_404_NOT_FOUND)
 
-        return Response({'reservation_id': reservation.id, 'equipment_id': equipment.id, 'position': position, 'waiting_count': waiting_count}, status=status.HTTP_201_CREATED)
+        try:
+            with equipment_lock(*candidate_ids):
+                equipments = list(Equipment.objects.select_for_update().filter(pk__in=candidate_ids).order_by('pk'))
+                assigned, queued = enqueue_group(user, equipments)
+                for equipment in equipments:
+                    notify_equipment_change(equipment)
+        except IntegrityError:
+            # 이미 후보 기구 중 하나 이상에 대기/알림 상태로 등록되어 있음
+            existing = list(
+                Reservation.objects.filter(user=user, equipment_id__in=candidate_ids, status__in=['WAITING', 'NOTIFIED'])
+                .select_related('equipment')
+            )
+            if existing:
+                items = []
+                for r in existing:
+                    position = get_queue_position(r, served_ticket=r.equipment.served_ticket)
+                    items.append({
+                        'reservation_id': r.id,
+                        'equipment_id': r.equipment_id,
+                        'status': r.status,
+                        'position': position,
+                        'waiting_count': r.equipment.waiting_count,
+                        'estimated_wait_seconds': 0 if r.status == 'NOTIFIED' else estimate_wait_seconds(r.equipment, position),
+                    })
+                return Response({'detail': '이미 대기열에 등록되어 있습니다.', 'reservations': items}, status=status.HTTP_200_OK)
+            return Response({'error': '잠시 후 다시 시도해주세요.'}, status=status.HTTP_409_CONFLICT)
+
+        if assigned is not None:
+            return Response({
+                'assigned': True,
+                'reservation_id': assigned.id,
+                'equipment_id': assigned.equipment_id,
+                'status': assigned.status,
+                'position': 1,
+                'waiting_count': 0,
+                'estimated_wait_seconds': 0,
+            }, status=status.HTTP_201_CREATED)
+
+        return Response({
+            'assigned': False,
+            'claim_group': str(queued[0][0].claim_group),
+            'reservations': [
+                {
+                    'reservation_id': reservation.id,
+                    'equipment_id': reservation.equipment_id,
+                    'status': reservation.status,
+                    'position': waiting_count,
+                    'waiting_count': waiting_count,
+                    'estimated_wait_seconds': estimate_wait_seconds(reservation.equipment, waiting_count),
+                }
+                for reservation, waiting_count in queued
+            ],
+            # 여러 기구 중 가장 먼저 비는 기구 기준
+            'estimated_wait_seconds': min(
+                estimate_wait_seconds(reservation.equipment, waiting_count) for reservation, waiting_count in queued
+            ),
+        }, status=status.HTTP_201_CREATED)
 
 
 class LeaveQueueView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @idempotent('leave')
     def post(self, request, *args, **kwargs):
         """
         사용자가 대기열에서 취소(또는 알림 후 포기)할 때 호출합니다.
@@ -313,19 +473,23 @@ class LeaveQueueView(APIView):
         else:
             return Response({'error': 'reservation_id 또는 equipment_id를 제공해주세요.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # 예약을 만료시키거나 삭제 처리
-        reservation.status = 'EXPIRED'
-        reservation.save()
-
-        # 남아 있는 대기자 중 가장 앞사람을 알림 상태로 변경
-        equipment = reservation.equipment
-        next_reservation = Reservation.objects.filter(equipment=equipment, status='WAITING').order_by('created_at').first()
-        if next_reservation:
-            next_reservation.status = 'NOTIFIED'
-            next_reservation.notified_at = timezone.now()
-            next_reservation.save()
-            # TODO: FCM 푸시 알림 전송
-
-        waiting_count = Reservation.objects.filter(equipment=equipment, status='WAITING').count()
-        notify_equipment_change(equipment)
+        with equipment_lock(reservation.equipment_id):
+            # 예약을 만료시키거나 삭제 처리 (잠금 안에서 최신 상태를 다시 읽음)
+            reservation.refresh_from_db(fields=['status'])
+            previous_status = reservation.status
+            reservation.status = 'EXPIRED'
+            reservation.save()
+            adjust_waiting_count(reservation.equipment_id, waiting_delta(previous_status, 'EXPIRED'))
+            # 그룹 대기였다면 다른 기구의 대기도 함께 철회 (하나의 논리적 대기표)
+            if reservation.claim_group is not None:
+                withdraw_sibling_claims([reservation.pk])
+
+            # 알림 받은 사람이 포기한 경우에만 남아 있는 대기자 중 가장 앞사람을 알림 상태로 변경
+            # (대기 중이던 사람이 빠지면 알림 자리는 그대로입니다)
+            equipment = reservation.equipment
+            if previous_status == 'NOTIFIED':
+                bulk_promote_heads({equipment.pk: 1})
+
+            waiting_count = get_waiting_count(equipment.pk)
+            notify_equipment_change(equipment)
         return Response({'message': '대기열에서 탈퇴 처리되었습니다.', 'waiting_count': waiting_count}, status=status.HTTP_200_OK)
\ No newline at end of file